@@ -1,120 +1,435 @@
+import os
 import re
+import mmap
+import gzip
+import lzma
+import shutil
+import tempfile
+import json
+import hashlib
 import numpy as np
+from contextlib import contextmanager
+from .transitions import TransitionSet
+from .progress import warn, timed
 
-#########################
-#                       #
-#  State Energy Reader  #
-#                       #
-#########################
-def Molcas_eigenE(filename, SOC=False):
-    data = []
+#################################
+#                               #
+#  Single-Pass Section Scanner  #
+#                               #
+#################################
+SECTION_HEADERS = {
+    'SF Dipole': 'Dipole transition strengths (spin-free states):',
+    'SF Velocity': 'Velocity transition strengths (spin-free states):',
+    'SF Quadrupole': 'Second-order contribution to the transition strengths (spin-free states):',
+    'SO Dipole': 'Dipole transition strengths (SO states):',
+    'SO Velocity': 'Velocity transition strengths (SO states):',
+    'SO Quadrupole': 'Second-order contribution to the transition strengths (SO states):',
+    'SF Vector': 'Dipole transition vectors (spin-free states):',
+    'SO Vector': 'Complex transition dipole vectors (SO states):',
+}
 
+ENERGY_HEADERS = {'SF Energy': 'SF State', 'SO Energy': 'SO State'}
+
+MATRIX_HEADERS = {'SF Matrix': '++ Matrix elements', 'SO Matrix': '++ Matrix elements over SO states'}
+
+_header = re.compile('|'.join(re.escape(h) for h in SECTION_HEADERS.values()))
+_dash = re.compile(r'^\s*-+\s*$')
+_digit = re.compile(r'^\s*\d+')
+_energy_row = re.compile(r'^\s*(\d+)\s+([-0-9.Ee]+)\s+([-0-9.Ee]+)\s+([-0-9.Ee]+)')
+_int_row = re.compile(r'^\s*(\d+)\s+(\d+)\s+([0-9.Ee+-]+)')
+_sf_vec_row = re.compile(r'^\s*(\d+)\s+(\d+)' + r'\s+([0-9.Ee+-]+)' * 3)
+_so_vec_row = re.compile(r'^\s*(\d+)\s+(\d+)' + r'\s+([0-9.Ee+-]+)' * 6)
+_property = re.compile(r'^PROPERTY:\s*MLTPL\s+(\d+)\s+COMPONENT:\s*(\d+)')
+_sf_number = re.compile(r"[-+]?\d*\.\d+E[+-]?\d+")
+_so_number = re.compile(r"\(\s*([-+]?\d*\.\d+)\s*,\s*([-+]?\d*\.\d+)\s*\)")
+_brackets = bytes.maketrans(b'(),', b'   ')
+_numeric = b'0123456789.eE+- \t\r\n'
+
+ROW_CHUNK = 4096            # table rows held as Python lists before they are packed into an array
+
+def energy_section(SOC=False):
+    return 'SO Energy' if SOC else 'SF Energy'
+
+def int_section(SOC=False, Quadrupole=False, Velocity=False):
+    if Quadrupole:
+        kind = 'Quadrupole'
+    elif Velocity:
+        kind = 'Velocity'
+    else:
+        kind = 'Dipole'
+        
+    return ('SO ' if SOC else 'SF ') + kind
+
+def vec_section(SOC=False):
+    return 'SO Vector' if SOC else 'SF Vector'
+
+def me_section(SOC=False):
+    return 'SO Matrix' if SOC else 'SF Matrix'
+
+def _parse_row(key, line):
+    if key == 'SO Vector':
+        match = _so_vec_row.match(line)
+        if match:
+            v = [float(x) for x in match.groups()[2:]]
+            return [int(match.group(1)), int(match.group(2)), complex(v[0], v[1]), complex(v[2], v[3]), complex(v[4], v[5])]
+    elif key == 'SF Vector':
+        match = _sf_vec_row.match(line)
+        if match:
+            return [int(match.group(1)), int(match.group(2))] + [float(x) for x in match.groups()[2:]]
+    else:
+        match = _int_row.match(line)
+        if match:
+            return [int(match.group(1)), int(match.group(2)), float(match.group(3))]
+    return None
+
+def _rows_array(key, rows):
+    if key == 'SO Vector':
+        return np.array(rows, dtype=complex).reshape(-1, 5)
+    elif key == 'SF Vector':
+        return np.array(rows, dtype=float).reshape(-1, 5)
+    elif key in ENERGY_HEADERS:
+        return np.array(rows, dtype=float).reshape(-1, 4)
+    else:
+        return np.array(rows, dtype=float).reshape(-1, 3)
+
+def _add_row(rows, tables, key, row):
+    # rows are packed into an array every ROW_CHUNK rows, so no more than that many are Python objects at once
+    rows[key].append(row)
+    if len(rows[key]) >= ROW_CHUNK:
+        tables[key].append(_rows_array(key, rows[key]))
+        rows[key] = []
+
+def _parse_matrix_row(SOC, line):
+    # an overflowed field ("**********") is read as 0
     if SOC:
-        start_line = 'SO State' 
+        nums = _so_number.findall(line.replace("**********", "  0.000000"))
+        return [complex(float(x), float(y)) for x, y in nums]
     else:
-        start_line = 'SF State' 
+        return [float(x) for x in _sf_number.findall(line.replace("**********", "0.00000000E+00"))]
+
+def _matrix_block(block, SOC, ncol):
+    # one STATE column block (bytes): rows of a state number and ncol values, (re,im) pairs for SO states,
+    # converted in one vectorized step; blocks with any other text are parsed line by line
+    text = block.replace(b"**********", b"0").translate(_brackets)
+    width = 1 + (2 if SOC else 1) * ncol
+    
+    if ncol and not text.translate(None, _numeric):
+        values = np.fromstring(text, sep=' ')
+        if values.size % width == 0:
+            values = values.reshape(-1, width)[:, 1:]
+            return values[:, 0::2] + 1j * values[:, 1::2] if SOC else values
         
-    with open(filename, 'r') as f:
-        lines = f.readlines()
+    rows = [_parse_matrix_row(SOC, line) for line in block.decode(errors='replace').splitlines() if _digit.match(line)]
+    rows = [row for row in rows if row]
+    
+    return np.array(rows, dtype=complex if SOC else float).reshape(len(rows), -1)
 
-    table_start = False
-    skip_line = False
+def _marked_lines(buf, mark, start, end):
+    # (start, end) of the lines of buf[start:end] containing mark, found by plain byte search
+    pos = buf.find(mark, start, end)
+    
+    while pos >= 0:
+        line_start = max(buf.rfind(b'\n', start, pos) + 1, start)
+        line_end = buf.find(b'\n', pos, end)
+        line_end = end if line_end < 0 else line_end
+        yield line_start, line_end
+        pos = buf.find(mark, line_end, end)
 
-    for line in lines:
-        if start_line in line:
-            table_start = True
-            skip_line = True
+def _matrix_section(buf, start, end, SOC, mltpl=None):
+    # {(MLTPL, COMPONENT): matrix} of the section in buf[start:end] (only MLTPL mltpl if given);
+    # the blocks of a component fill one preallocated matrix
+    props = []
+    for a, b in _marked_lines(buf, b'PROPERTY', start, end):
+        match = _property.match(buf[a:b].decode(errors='replace').strip())
+        if match:
+            props.append((a, b, (int(match.group(1)), int(match.group(2)))))
+    matrices = {}
+    
+    for k, (_, prop_end, comp) in enumerate(props):
+        if mltpl is not None and comp[0] != mltpl:
             continue
-        if table_start:
-            if skip_line:
-                skip_line = False
+        stop = props[k + 1][0] if k + 1 < len(props) else end
+        states = [(a, b) for a, b in _marked_lines(buf, b'STATE', prop_end, stop) if buf[a:b].strip().startswith(b'STATE')]
+        ncols = [len(buf[a:b].partition(b':')[2].split()) for a, b in states]
+        matrix, c0 = None, 0
+        
+        for n, (a, b) in enumerate(states):
+            block = _matrix_block(buf[b:states[n + 1][0] if n + 1 < len(states) else stop], SOC, ncols[n])
+            if matrix is None:
+                matrix = np.zeros((len(block), sum(ncols)), dtype=complex if SOC else float)
+            if block.shape[1] != ncols[n]:
+                raise ValueError(f"Matrix block of MLTPL {comp[0]} COMPONENT {comp[1]} has {block.shape[1]} columns, its STATE line lists {ncols[n]}.")
+            matrix[:, c0:c0 + ncols[n]] = block
+            c0 += ncols[n]
+            
+        if matrix is None:
+            matrix = np.zeros((0, 0), dtype=complex if SOC else float)
+        matrices[comp] = np.hstack([matrices[comp], matrix]) if comp in matrices and matrices[comp].size else matrix
+        
+    return matrices
+
+def _matrix_spans(buf):
+    # byte range of the first section of each matrix kind, up to its closing "--" line
+    spans = {}
+    
+    for a, b in _marked_lines(buf, b'++ Matrix elements', 0, len(buf)):
+        line = buf[a:b].rstrip()
+        name = {b'++ Matrix elements': 'SF Matrix', b'++ Matrix elements over SO states': 'SO Matrix'}.get(line)
+        if name is None or name in spans:
+            continue
+        end = next((c for c, d in _marked_lines(buf, b'--', b, len(buf)) if buf[c:d].strip() == b'--'), len(buf))
+        spans[name] = (a, end)
+            
+    return spans
+
+def _text_lines(buf, skip=(), chunk=1 << 20):
+    # decoded lines of buf outside the byte ranges in skip, split about a MB at a time
+    pos = 0
+    
+    for start, end in sorted(skip) + [(len(buf), len(buf))]:
+        while pos < start:
+            stop = min(pos + chunk, start)
+            if stop < start:
+                newline = buf.find(b'\n', stop, start)
+                stop = start if newline < 0 else newline + 1
+            yield from buf[pos:stop].decode(errors='replace').splitlines(keepends=True)
+            pos = stop
+        pos = max(pos, end)
+
+@contextmanager
+def output_buffer(filename):
+    # the output file as a read-only memory map; .gz and .xz outputs are decompressed as a stream into a temporary file first
+    opener = {'.gz': gzip.open, '.xz': lzma.open}.get(os.path.splitext(os.fspath(filename))[1].lower())
+    
+    with (tempfile.TemporaryFile() if opener else open(filename, 'rb')) as f:
+        if opener:
+            with opener(filename, 'rb') as source:
+                shutil.copyfileobj(source, f, 1 << 22)
+            f.flush()
+            
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield buf
+        finally:
+            buf.close()
+
+def Molcas_scan(filename, sections=None, mltpl=None):
+    # one pass over the memory-mapped output (.out, .out.gz or .out.xz); sections=None parses every known section,
+    # otherwise only the listed keys. Matrix sections are located first and converted block by block in bulk,
+    # the other sections are read line by line from the rest of the file; mltpl keeps only that MLTPL of the matrices
+    known = list(ENERGY_HEADERS) + list(SECTION_HEADERS) + list(MATRIX_HEADERS)
+    wanted = set(known if sections is None else sections)
+    
+    rows = {key: [] for key in wanted if key not in MATRIX_HEADERS}
+    tables = {key: [] for key in rows}
+    done = set()
+    data = {}
+    
+    mode = None             # 'energy' or 'table'
+    key = None
+    skip_line = False
+    dash_count = 0
+    
+    with output_buffer(filename) as buf:
+        spans = _matrix_spans(buf)
+        for name in MATRIX_HEADERS:
+            if name in wanted:
+                data[name] = _matrix_section(buf, *spans[name], name == 'SO Matrix', mltpl) if name in spans else {}
+        
+        for line in _text_lines(buf, spans.values()):
+            if mode == 'energy':
+                if skip_line:
+                    skip_line = False
+                    continue
+                if line.strip() == "" or not _digit.match(line):
+                    done.add(key)
+                    mode = None
+                    continue
+                match = _energy_row.match(line)
+                if match:
+                    _add_row(rows, tables, key, [int(match.group(1)), float(match.group(2)), float(match.group(3)), float(match.group(4))])
+                continue
+                    
+            if mode == 'table':
+                if line.strip() == "--":
+                    done.add(key)
+                    mode = None
+                    continue
+                if _dash.match(line):
+                    dash_count += 1
+                    if dash_count > 2:
+                        done.add(key)
+                        mode = None
+                    continue
+                if dash_count == 2:
+                    row = _parse_row(key, line)
+                    if row is not None:
+                        _add_row(rows, tables, key, row)
                 continue
+            
+            if 'State' in line:
+                for name, start_line in ENERGY_HEADERS.items():
+                    if start_line in line and name in wanted and name not in done:
+                        mode, key, skip_line = 'energy', name, True
+                        break
+                if mode:
+                    continue
+            
+            if 'transition' in line:
+                match = _header.search(line)
+                if match:
+                    name = next(k for k, h in SECTION_HEADERS.items() if h == match.group(0))
+                    if name in wanted and name not in done:
+                        mode, key, dash_count = 'table', name, 0
+                    continue
+    
+    for name in rows:
+        data[name] = np.concatenate(tables[name] + [_rows_array(name, rows[name])])
+            
+    return data
 
-            if line.strip() == "" or not re.match(r'^\s*\d+', line):
-                break
+def me_matrix(matrices, mltpl, comp):
+    matrix = matrices.get((mltpl, comp), np.zeros((0, 0)))
+    
+    if matrix.size == 0 :
+        warn("Transition Data Reading Failed!")
+        
+    return matrix
+
+##########################
+#                        #
+#  Parsed Data Cache     #
+#                        #
+##########################
+CACHE_VERSION = 3
+
+def cache_entry(filename, cache, reader, **kwargs):
+    # entry folder keyed by file path, reader and its arguments; the stamp records size and mtime of the source
+    if cache is True:
+        folder = os.environ.get('POLARIXS_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'polarixs'))
+    else:
+        folder = os.fspath(cache)
+        
+    path = os.path.abspath(filename)
+    args = repr((CACHE_VERSION, path, reader, sorted(kwargs.items())))
+    stat = os.stat(path)
+    stamp = {'file': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'args': args}
+    
+    return os.path.join(folder, hashlib.sha1(args.encode()).hexdigest()), stamp
+
+def cache_load(entry):
+    folder, stamp = entry
+    
+    try:
+        with open(os.path.join(folder, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    if meta.get('stamp') != stamp:
+        return None
+    
+    data = {}
+    for name in meta['arrays']:
+        path = os.path.join(folder, name + '.npy')
+        try:
+            data[name] = np.load(path, mmap_mode='r')
+        except ValueError:
+            data[name] = np.load(path)     # empty arrays cannot be memory-mapped
+        except OSError:
+            return None
+        
+    return data
 
-            match = re.match(r'^\s*(\d+)\s+([-0-9.Ee]+)\s+([-0-9.Ee]+)\s+([-0-9.Ee]+)', line)
-            if match:
-                state = int(match.group(1))
-                rel_emin = float(match.group(2))
-                rel_ev = float(match.group(3))
-                rel_cm1 = float(match.group(4))
-                data.append([state, rel_emin, rel_ev, rel_cm1])
+def cache_store(entry, arrays):
+    folder, stamp = entry
+    os.makedirs(folder, exist_ok=True)
+    
+    meta_path = os.path.join(folder, 'meta.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    
+    for name, array in arrays.items():
+        tmp = os.path.join(folder, name + '.tmp.npy')
+        np.save(tmp, np.asarray(array))
+        os.replace(tmp, os.path.join(folder, name + '.npy'))
+    
+    tmp = meta_path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'stamp': stamp, 'arrays': list(arrays)}, f)
+    os.replace(tmp, meta_path)
+
+def cache_transitions(entry, T):
+    # each field of the transition set is stored as its own array
+    cache_store(entry, {'E': T.E, 'M': T.M, 'i': T.i, 'j': T.j})
+
+#########################
+#                       #
+#  State Energy Reader  #
+#                       #
+#########################
+def Molcas_eigenE(filename, SOC=False):
+    data = Molcas_scan(filename, [energy_section(SOC)])[energy_section(SOC)].tolist()
                 
     if not data:
-        print("Energy Data Reading Failed!")
+        warn("Energy Data Reading Failed!")
         
     return data
 
+def state_energy(eigenvalues):
+    # energy (eV) indexed directly by state number; the first row of a repeated state is kept, as in the tables
+    states = eigenvalues[:,0].astype(int)
+    energy = np.full(np.max(states, initial=0) + 1, np.nan)
+    energy[states[::-1]] = eigenvalues[::-1,2]
+    
+    return energy
+
 ################################
 #                              #
 #  DIprint and QIprint Reader  #
 #                              #
 ################################
 def Molcas_trans_int(filename, SOC=False, Quadrupole=False, Velocity=False):
-    data = []
-    
-    if SOC:
-        if Quadrupole:
-            start_line = 'Second-order contribution to the transition strengths (SO states):'
-        elif Velocity:
-            start_line = 'Velocity transition strengths (SO states):'
-        else:
-            start_line = 'Dipole transition strengths (SO states):'
-    else:
-        if Quadrupole:
-            start_line = 'Second-order contribution to the transition strengths (spin-free states):'
-        elif Velocity:
-            start_line = 'Velocity transition strengths (spin-free states):'
-        else:
-            start_line = 'Dipole transition strengths (spin-free states):'
-            
-    with open(filename, 'r') as file:
-        lines = file.readlines()
-    
-    table_start = False
-    dash_count = 0
-
-    for i, line in enumerate(lines):
-        if start_line in line:
-            table_start = True
-            continue
-
-        if table_start:
-            if re.match(r'^\s*-+\s*$', line):
-                dash_count += 1
-                continue
-
-            if dash_count == 2:
-                if re.match(r'^\s*-+\s*$', line):
-                    break
-                match = re.match(r'^\s*(\d+)\s+(\d+)\s+([0-9.Ee+-]+)', line)
-                if match:
-                    from_state = int(match.group(1))
-                    to_state = int(match.group(2))
-                    osc_strength = float(match.group(3))
-                    data.append([from_state, to_state, osc_strength])
+    key = int_section(SOC, Quadrupole, Velocity)
+    data = Molcas_scan(filename, [key])[key].tolist()
                     
     if not data:
-        print("Transition Data Reading Failed!")
+        warn("Transition Data Reading Failed!")
         
     return data
 
-def Molcas_read_int(filename, SOC=False, Quadrupole=False, Velocity=False, Subset=0, GStates = []): 
-    eigenvalues = np.array(Molcas_eigenE(filename, SOC))
-    transitions = np.array(Molcas_trans_int(filename, SOC, Quadrupole, Velocity))
+@timed('parse')
+def Molcas_read_int(filename, SOC=False, Quadrupole=False, Velocity=False, Subset=0, GStates = [], cache=False): 
+    if cache:
+        entry = cache_entry(filename, cache, 'int', SOC=SOC, Quadrupole=Quadrupole, Velocity=Velocity, Subset=Subset, GStates=list(GStates))
+        cached = cache_load(entry)
+        if cached is not None:
+            return TransitionSet(**cached)
+        
+    scan = Molcas_scan(filename, [energy_section(SOC), int_section(SOC, Quadrupole, Velocity)])
+    eigenvalues = scan[energy_section(SOC)]
+    transitions = scan[int_section(SOC, Quadrupole, Velocity)]
+    
+    if eigenvalues.size == 0:
+        warn("Energy Data Reading Failed!")
+    if transitions.size == 0:
+        warn("Transition Data Reading Failed!")
     
     if GStates:
         transitions = transitions[np.isin(transitions[:,0].real, GStates)]
-        data = np.zeros((np.shape(transitions)[0], 4))
-    else:
-        data = np.zeros((np.shape(transitions)[0], 4))
         
-    for i, line in enumerate(transitions):
-        data[i][0] = eigenvalues[eigenvalues[:,0].real == line[1]][0][2] - eigenvalues[eigenvalues[:,0].real == line[0]][0][2]
-        data[i][1] = line[2]
-        data[i][2] = line[0]
-        data[i][3] = line[1] - Subset
+    energy = state_energy(eigenvalues)
+    from_state = transitions[:,0].astype(int)
+    to_state = transitions[:,1].astype(int)
+    
+    data = TransitionSet(energy[to_state] - energy[from_state], transitions[:,2], from_state, to_state - Subset)
+        
+    if cache:
+        cache_transitions(entry, data)
         
     return data
 
@@ -124,89 +439,42 @@ def Molcas_read_int(filename, SOC=False, Quadrupole=False, Velocity=False, Subse
 #                        #
 ##########################
 def Molcas_trans_vec(filename, SOC=False):
-    data = []
-
-    with open(filename, 'r') as file:
-        lines = file.readlines()
-    
-    table_start = False
-    dash_count = 0
-    
-    if SOC:
-        start_line = 'Complex transition dipole vectors (SO states):' 
-
-        for i, line in enumerate(lines):
-            if start_line in line:
-                table_start = True
-                continue
-
-            if table_start:
-                if re.match(r'^\s*-+\s*$', line):
-                    dash_count += 1
-                    continue
-
-                if dash_count == 2:
-                    if re.match(r'^\s*-+\s*$', line):
-                        break
-                    match = re.match(r'^\s*(\d+)\s+(\d+)\s+([0-9.Ee+-]+)\s+([0-9.Ee+-]+)\s+([0-9.Ee+-]+)\s+([0-9.Ee+-]+)\s+([0-9.Ee+-]+)\s+([0-9.Ee+-]+)', line)
-                    if match:
-                        from_state = int(match.group(1))
-                        to_state = int(match.group(2))
-                        ReX = float(match.group(3))
-                        ImX = float(match.group(4))
-                        ReY = float(match.group(5))
-                        ImY = float(match.group(6))
-                        ReZ = float(match.group(7))
-                        ImZ = float(match.group(8))
-                        data.append([from_state, to_state, complex(ReX, ImX), complex(ReY, ImY), complex(ReZ, ImZ)])
-                        
-    else:
-        start_line = 'Dipole transition vectors (spin-free states):'
-
-        for i, line in enumerate(lines):
-            if start_line in line:
-                table_start = True
-                continue
-
-            if table_start:
-                if re.match(r'^\s*-+\s*$', line):
-                    dash_count += 1
-                    continue
-                    
-                if dash_count == 2:
-                    if re.match(r'^\s*-+\s*$', line):
-                        break
-                    match = re.match(r'^\s*(\d+)\s+(\d+)\s+([0-9.Ee+-]+)\s+([0-9.Ee+-]+)\s+([0-9.Ee+-]+)\s+([0-9.Ee+-]+)', line)
-                    if match:
-                        from_state = int(match.group(1))
-                        to_state = int(match.group(2))
-                        X = float(match.group(3))
-                        Y = float(match.group(4))
-                        Z = float(match.group(5))
-                        data.append([from_state, to_state, X, Y, Z])
+    data = Molcas_scan(filename, [vec_section(SOC)])[vec_section(SOC)].tolist()
 
     if not data:
-        print("Transition Data Reading Failed!")
+        warn("Transition Data Reading Failed!")
         
     return data
 
-def Molcas_read_vec(filename, SOC=False, Subset=0, GStates = []): 
-    eigenvalues = np.array(Molcas_eigenE(filename, SOC))
-    transitions = np.array(Molcas_trans_vec(filename, SOC))
+@timed('parse')
+def Molcas_read_vec(filename, SOC=False, Subset=0, GStates = [], cache=False): 
+    if cache:
+        entry = cache_entry(filename, cache, 'vec', SOC=SOC, Subset=Subset, GStates=list(GStates))
+        cached = cache_load(entry)
+        if cached is not None:
+            return TransitionSet(**cached)
+        
+    scan = Molcas_scan(filename, [energy_section(SOC), vec_section(SOC)])
+    eigenvalues = scan[energy_section(SOC)]
+    transitions = scan[vec_section(SOC)]
+    
+    if eigenvalues.size == 0:
+        warn("Energy Data Reading Failed!")
+    if transitions.size == 0:
+        warn("Transition Data Reading Failed!")
     
     if GStates:
         transitions = transitions[np.isin(transitions[:,0].real, GStates)]
-        data = np.zeros((np.shape(transitions)[0], 6), dtype=complex)
-    else:
-        data = np.zeros((np.shape(transitions)[0], 6), dtype=complex)
         
-    for i, line in enumerate(transitions):
-        data[i][0] = eigenvalues[eigenvalues[:,0].real == line[1]][0][2] - eigenvalues[eigenvalues[:,0].real == line[0]][0][2]
-        data[i][1] = line[2]
-        data[i][2] = line[3]
-        data[i][3] = line[4]
-        data[i][4] = line[0]
-        data[i][5] = line[1] - Subset
+    energy = state_energy(eigenvalues)
+    from_state = transitions[:,0].real.astype(int)
+    to_state = transitions[:,1].real.astype(int)
+    
+    # SF vectors stay real, SO vectors complex
+    data = TransitionSet(energy[to_state] - energy[from_state], transitions[:,2:5], from_state, to_state - Subset)
+        
+    if cache:
+        cache_transitions(entry, data)
         
     return data
 
@@ -216,143 +484,51 @@ def Molcas_read_vec(filename, SOC=False, Subset=0, GStates = []):
 #                        #
 ##########################
 def Molcas_trans_me(filename, SOC=False, mltpl=None, comp=None):
+    matrices = Molcas_scan(filename, [me_section(SOC)], mltpl)[me_section(SOC)]
     
-    if SOC:
-        block_start = "++ Matrix elements over SO states"
-    else:
-        block_start = "++ Matrix elements"
-        
-    matrix_start = f"PROPERTY: MLTPL  {mltpl}   COMPONENT:   {comp}"
-    
-    block_capture = False
-    matrix_capture = False
-    lines = []
-
-    with open(filename, "r") as f:
-        for line in f:
-            if line.strip() == block_start:
-                block_capture = True
-                continue
-            if line.strip() == "--":
-                block_capture = False
-                continue
-            if block_capture and line.strip().startswith(matrix_start):
-                matrix_capture = True
-                continue
-            if matrix_capture and line.strip().startswith("PROPERTY"):
-                break
-            if matrix_capture:
-                lines.append(line)
+    return me_matrix(matrices, mltpl, comp)
 
-    data = "\n".join(lines)
-
-    blocks = []
+@timed('parse')
+def Molcas_read_ten(filename, SOC=False, Mltpl=2, Subset=0, GStates=[], Threshold=0, cache=False): 
+    if cache:
+        entry = cache_entry(filename, cache, 'ten', SOC=SOC, Mltpl=Mltpl, Subset=Subset, GStates=list(GStates), Threshold=Threshold)
+        cached = cache_load(entry)
+        if cached is not None:
+            return TransitionSet(**cached)
     
-    if SOC:
-        number_pattern = r"\(\s*([-+]?\d*\.\d+)\s*,\s*([-+]?\d*\.\d+)\s*\)"
-        
-        data = data.replace("**********", "  0.000000")
-        
-        for block in data.split("STATE"): 
-            rows = []
-            for line in block.splitlines():
-                if not line.strip():
-                    continue
-                if re.match(r"^\s*\d+", line):  
-                    nums = re.findall(number_pattern, line)
-                    if nums:
-                        rows.append([complex(float(x), float(y)) for x, y in nums])
-            if rows:
-                blocks.append(np.array(rows))
-
-    else:
-        number_pattern = r"[-+]?\d*\.\d+E[+-]?\d+"
-        
-        for block in data.split("STATE"): 
-            rows = []
-            for line in block.splitlines():
-                if not line.strip():
-                    continue
-                if re.match(r"^\s*\d+", line):  
-                    nums = re.findall(number_pattern, line)
-                    if nums:
-                        rows.append([float(x) for x in nums])
-            if rows:
-                blocks.append(np.array(rows))
-
-    matrix = np.hstack(blocks)
-
-    if matrix.size == 0 :
-        print("Transition Data Reading Failed!")
-        
-    return matrix
-
-def Molcas_read_ten(filename, SOC=False, Mltpl=2, Subset=0, GStates=[], Threshold=0): 
+    scan = Molcas_scan(filename, [energy_section(SOC), me_section(SOC)], Mltpl)
+    eigenvalues = scan[energy_section(SOC)]
+    matrices = scan[me_section(SOC)]
     
-    data = []
+    if eigenvalues.size == 0:
+        warn("Energy Data Reading Failed!")
     
-    eigenvalues = np.array(Molcas_eigenE(filename, SOC))
+    # Mltpl=1: x, y, z; Mltpl=2: xx, xy, xz, yy, yz, zz
+    Ncomp = (Mltpl + 1) * (Mltpl + 2) // 2
+    comps = [me_matrix(matrices, Mltpl, c) for c in range(1, Ncomp + 1)]
     
-    if Mltpl == 1:
-        tx = np.array(Molcas_trans_me(filename, SOC, Mltpl, 1))
-        ty = np.array(Molcas_trans_me(filename, SOC, Mltpl, 2))
-        tz = np.array(Molcas_trans_me(filename, SOC, Mltpl, 3))
-        
-        Nstates = np.shape(tx)[0]
-        Ng = Nstates
-        nf = 0
-        
-        if Subset != 0:
-            Ng = Subset
-            nf = Subset
-        
-        for i in range(0, Ng):
-            if GStates and i+1 not in GStates:
-                continue
-            for j in range(nf, Nstates):
-                line = np.zeros(6, dtype=complex)
-                line[0] = eigenvalues[j][2] - eigenvalues[i][2]
-                line[1] = tx[i, j]
-                line[2] = ty[i, j]
-                line[3] = tz[i, j]
-                line[4] = i + 1
-                line[5] = j + 1 - Subset
-                
-                if np.sum(np.abs(line[1:4]) > Threshold):
-                    data.append(line)   
+    Nstates = np.shape(comps[0])[0]
+    Ng = Nstates
+    nf = 0
+    
+    if Subset != 0:
+        Ng = Subset
+        nf = Subset
         
-    if Mltpl == 2:
-        txx = np.array(Molcas_trans_me(filename, SOC, Mltpl, 1))
-        txy = np.array(Molcas_trans_me(filename, SOC, Mltpl, 2))
-        txz = np.array(Molcas_trans_me(filename, SOC, Mltpl, 3))
-        tyy = np.array(Molcas_trans_me(filename, SOC, Mltpl, 4))
-        tyz = np.array(Molcas_trans_me(filename, SOC, Mltpl, 5))
-        tzz = np.array(Molcas_trans_me(filename, SOC, Mltpl, 6))
-            
-        Nstates = np.shape(txx)[0]
-        Ng = Nstates
-        nf = 0
+    g_idx = np.arange(0, Ng)
+    if GStates:
+        g_idx = g_idx[np.isin(g_idx + 1, GStates)]
+    f_idx = np.arange(nf, Nstates)
+    
+    # only the (g, f) block is stacked, not a second copy of the full matrices
+    block = np.stack([M[g_idx][:, f_idx] for M in comps], axis=-1)
+    i, j = np.nonzero(np.any(np.abs(block) > Threshold, axis=-1))
+    
+    energy = state_energy(eigenvalues)
+    
+    data = TransitionSet(energy[f_idx[j] + 1] - energy[g_idx[i] + 1], block[i, j], g_idx[i] + 1, f_idx[j] + 1 - Subset)
+    
+    if cache:
+        cache_transitions(entry, data)
         
-        if Subset != 0:
-            Ng = Subset
-            nf = Subset
-              
-        for i in range(0, Ng):
-            if GStates and i+1 not in GStates:
-                continue
-            for j in range(nf, Nstates):
-                line = np.zeros(9, dtype=complex)
-                line[0] = eigenvalues[j][2] - eigenvalues[i][2]
-                line[1] = txx[i, j]
-                line[2] = txy[i, j]
-                line[3] = txz[i, j]
-                line[4] = tyy[i, j]
-                line[5] = tyz[i, j]
-                line[6] = tzz[i, j]
-                line[7] = i + 1
-                line[8] = j + 1 - Subset
-                
-                if np.sum(np.abs(line[1:7]) > Threshold):
-                    data.append(line)   
-                    
-    return np.array(data)
\ No newline at end of file
+    return data
\ No newline at end of file
@@ -1,8 +1,14 @@
-from .MolcasReader import Molcas_read_int, Molcas_read_vec, Molcas_read_ten
-from .spc_conv import xas_conv, rixs_conv
-from .pw_rixs_dd import pw_dd_conv
-from .pw_rixs_qd import pw_qd_conv
-from .sc_rixs_dd import sc_dd_conv
-from .sc_rixs_qd import sc_qd_conv
+from .transitions import TransitionSet, as_transitions
+from .progress import set_progress, console_progress, profiling, Stats
+from .MolcasReader import Molcas_scan, Molcas_read_int, Molcas_read_vec, Molcas_read_ten
+from .calculation import RixsCalc
+from .rixs_engine import thermal_weights
+from .spc_conv import xas_conv, rixs_conv, rixs_sticks, rixs_calc
+from .broadening import stick_conv, arctan_gamma, step_gamma
+from .pw_rixs_dd import pw_dd_sticks, pw_dd_conv, pw_dd_invariants, pw_dd_scan, pw_dd_calc
+from .pw_rixs_qd import pw_qd_sticks, pw_qd_conv, pw_qd_invariants, pw_qd_scan, pw_qd_calc
+from .sc_rixs_dd import sc_dd_sticks, sc_dd_conv, sc_dd_calc
+from .sc_rixs_qd import sc_qd_sticks, sc_qd_conv, sc_qd_calc
+from .batch import load_jobs, run_jobs
 
-__all__ = ['Molcas_read_int', 'Molcas_read_vec', 'Molcas_read_ten', 'xas_conv', 'rixs_conv', 'pw_dd_conv', 'pw_qd_conv', 'sc_dd_conv', 'sc_qd_conv']
\ No newline at end of file
+__all__ = ['TransitionSet', 'as_transitions', 'set_progress', 'console_progress', 'profiling', 'Stats', 'Molcas_scan', 'Molcas_read_int', 'Molcas_read_vec', 'Molcas_read_ten', 'thermal_weights', 'xas_conv', 'rixs_conv', 'rixs_sticks', 'rixs_calc', 'RixsCalc', 'stick_conv', 'arctan_gamma', 'step_gamma', 'pw_dd_sticks', 'pw_dd_conv', 'pw_dd_invariants', 'pw_dd_scan', 'pw_dd_calc', 'pw_qd_sticks', 'pw_qd_conv', 'pw_qd_invariants', 'pw_qd_scan', 'pw_qd_calc', 'sc_dd_sticks', 'sc_dd_conv', 'sc_dd_calc', 'sc_qd_sticks', 'sc_qd_conv', 'sc_qd_calc', 'load_jobs', 'run_jobs']
\ No newline at end of file
@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import argparse
+import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .progress import profiling, progress, set_progress
+from . import MolcasReader, spc_conv, pw_rixs_dd, pw_rixs_qd, sc_rixs_dd, sc_rixs_qd
+
+#############
+#           #
+#  Engines  #
+#           #
+#############
+READERS = {
+    'int': MolcasReader.Molcas_read_int,
+    'vec': MolcasReader.Molcas_read_vec,
+    'ten': MolcasReader.Molcas_read_ten,
+}
+
+# engine: (function, transition inputs, names of the returned maps)
+ENGINES = {
+    'xas_conv': (spc_conv.xas_conv, ('T',), ('I',)),
+    'rixs_conv': (spc_conv.rixs_conv, ('gn', 'nf'), ('I',)),
+    'pw_dd_conv': (pw_rixs_dd.pw_dd_conv, ('gn', 'nf'), ('I',)),
+    'pw_dd_invariants': (pw_rixs_dd.pw_dd_invariants, ('gn', 'nf'), ('IA', 'IB')),
+    'pw_dd_scan': (pw_rixs_dd.pw_dd_scan, ('gn', 'nf'), ('I',)),
+    'pw_qd_conv': (pw_rixs_qd.pw_qd_conv, ('gn', 'nf'), ('I',)),
+    'pw_qd_invariants': (pw_rixs_qd.pw_qd_invariants, ('gn', 'nf'), ('IA', 'IB')),
+    'pw_qd_scan': (pw_rixs_qd.pw_qd_scan, ('gn', 'nf'), ('I',)),
+    'sc_dd_conv': (sc_rixs_dd.sc_dd_conv, ('gn', 'nf'), ('I',)),
+    'sc_qd_conv': (sc_rixs_qd.sc_qd_conv, ('gn', 'nf'), ('I',)),
+}
+
+###############
+#             #
+#  Job Files  #
+#             #
+###############
+def job_grid(grid):
+    # a list of energies, or {"start", "stop", "num"} for an even grid
+    if isinstance(grid, dict):
+        return np.linspace(grid['start'], grid['stop'], int(grid['num']))
+
+    return np.asarray(grid, dtype=float)
+
+def job_options(options):
+    # matrices (R, filters) arrive as nested lists, weights with string keys
+    options = {key: np.asarray(value, dtype=float) if key == 'R' or key.startswith('filter') else value for key, value in options.items()}
+    if isinstance(options.get('weights'), dict):
+        options['weights'] = {int(g): float(w) for g, w in options['weights'].items()}
+
+    return options
+
+def input_key(spec, root):
+    # one parse per distinct (file, reader, reader options)
+    spec = dict(spec)
+    path = os.path.normpath(os.path.join(root, spec.pop('file')))
+    reader = spec.pop('reader', 'vec')
+    if reader not in READERS:
+        raise ValueError(f"Unknown reader: {reader!r}. Use 'int', 'vec' or 'ten'.")
+
+    return (path, reader, json.dumps(spec, sort_keys=True))
+
+def load_jobs(filename):
+    # a JSON job file: {"defaults": {...}, "jobs": [{...}, ...]}; every job is merged over the defaults
+    with open(filename, 'r') as f:
+        spec = json.load(f)
+
+    root = os.path.dirname(os.path.abspath(filename))
+    defaults = spec.get('defaults', {})
+    jobs = []
+
+    for k, job in enumerate(spec['jobs']):
+        job = {**defaults, **job, 'options': {**defaults.get('options', {}), **job.get('options', {})}}
+        job.setdefault('name', f"job{k}")
+        if job.get('engine') not in ENGINES:
+            raise ValueError(f"Job {job['name']!r}: unknown engine {job.get('engine')!r}. Use one of {', '.join(ENGINES)}.")
+        job['inputs'] = {name: input_key(job[name], root) for name in ENGINES[job['engine']][1]}
+        jobs.append(job)
+
+    names = [job['name'] for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError("Job names must be unique.")
+
+    return jobs
+
+################
+#              #
+#  Job Runner  #
+#              #
+################
+def parse_task(key):
+    path, reader, options = key
+    start = time.perf_counter()
+    T = READERS[reader](path, **json.loads(options))
+
+    return T, time.perf_counter() - start
+
+def job_task(job, inputs, out, fmt):
+    func, names, results = ENGINES[job['engine']]
+    timing = {}
+
+    start = time.perf_counter()
+    w_inc = job_grid(job['w_inc'])
+    args = [w_inc] if job['engine'] == 'xas_conv' else [w_inc, job_grid(job['w_los'])]
+    with profiling() as stats:
+        I = func(*args, *(inputs[name] for name in names), **job_options(job['options']))
+    timing['compute'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    arrays = dict(zip(results, I if len(results) > 1 else (I,)))
+    arrays['w_inc'] = w_inc
+    if len(args) > 1:
+        arrays['w_los'] = args[1]
+    path = save_result(os.path.join(out, job['name']), arrays, fmt)
+    timing['save'] = time.perf_counter() - start
+
+    return path, timing, {name: list(np.shape(value)) for name, value in arrays.items()}, stats.as_dict()
+
+def save_result(path, arrays, fmt='npz'):
+    if fmt == 'npz':
+        np.savez_compressed(path + '.npz', **arrays)
+        return path + '.npz'
+    if fmt == 'h5':
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("HDF5 output requires h5py.") from None
+        with h5py.File(path + '.h5', 'w') as f:
+            for name, value in arrays.items():
+                f.create_dataset(name, data=value, compression='gzip')
+        return path + '.h5'
+
+    raise ValueError(f"Unknown format: {fmt!r}. Use 'npz' or 'h5'.")
+
+def run_jobs(jobs, out, workers=None, fmt='npz'):
+    # parses every distinct input once, then runs the jobs, both spread over one process pool;
+    # writes one result file per job and manifest.json with the timings
+    os.makedirs(out, exist_ok=True)
+    start = time.perf_counter()
+    manifest = {'workers': workers or os.cpu_count(), 'format': fmt, 'inputs': [], 'jobs': []}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        keys = sorted({key for job in jobs for key in job['inputs'].values()})
+        parsed, failed = {}, {}
+        futures = {pool.submit(parse_task, key): key for key in keys}
+
+        for future in as_completed(futures):
+            path, reader, options = key = futures[future]
+            entry = {'file': path, 'reader': reader, 'options': json.loads(options)}
+            try:
+                parsed[key] = future.result()
+                entry['time'], entry['transitions'] = parsed[key][1], len(parsed[key][0])
+            except Exception as error:
+                failed[key] = entry['error'] = f"{type(error).__name__}: {error}"
+            manifest['inputs'].append(entry)
+            progress('parsed', f"Parsed {os.path.basename(path)} ({reader}): {entry.get('error', 'ok')}", **entry)
+
+        futures = {}
+        for job in jobs:
+            missing = [failed[key] for key in job['inputs'].values() if key in failed]
+            if missing:
+                manifest['jobs'].append({'name': job['name'], 'engine': job['engine'], 'status': 'error', 'error': f"input failed: {missing[0]}"})
+                continue
+            inputs = {name: parsed[key][0] for name, key in job['inputs'].items()}
+            futures[pool.submit(job_task, job, inputs, out, fmt)] = job
+
+        for future in as_completed(futures):
+            job = futures[future]
+            entry = {'name': job['name'], 'engine': job['engine'], 'inputs': {name: key[0] for name, key in job['inputs'].items()}}
+            try:
+                entry['output'], entry['time'], entry['shapes'], entry['stats'] = future.result()
+                entry['time']['parse'] = sum(parsed[key][1] for key in set(job['inputs'].values()))
+                entry['status'] = 'ok'
+            except Exception as error:
+                entry['status'] = 'error'
+                entry['error'] = f"{type(error).__name__}: {error}"
+                entry['traceback'] = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+            manifest['jobs'].append(entry)
+            progress('job', f"Finished {job['name']}: {entry.get('error', 'ok')}", **entry)
+
+    order = {job['name']: k for k, job in enumerate(jobs)}
+    manifest['jobs'].sort(key=lambda entry: order[entry['name']])
+    manifest['time'] = time.perf_counter() - start
+    with open(os.path.join(out, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    return manifest
+
+def batch_console(event, message, info):
+    # the command line shows each parsed input and finished job
+    if event in ('parsed', 'job', 'warning'):
+        print(message, flush=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m Polarixs', description="Run a JSON file of Polarixs jobs over a process pool.")
+    parser.add_argument('jobfile')
+    parser.add_argument('-o', '--out', help="output folder (default: results next to the job file)")
+    parser.add_argument('-j', '--workers', type=int, help="number of processes (default: all cores)")
+    parser.add_argument('-f', '--format', choices=['npz', 'h5'], default='npz')
+    args = parser.parse_args(argv)
+
+    out = args.out or os.path.join(os.path.dirname(os.path.abspath(args.jobfile)), 'results')
+    set_progress(batch_console)
+    try:
+        manifest = run_jobs(load_jobs(args.jobfile), out, args.workers, args.format)
+    finally:
+        set_progress(None)
+    failed = [entry['name'] for entry in manifest['jobs'] if entry['status'] != 'ok']
+    print(f"{len(manifest['jobs']) - len(failed)} of {len(manifest['jobs'])} jobs done in {manifest['time']:.1f} s, results in {out}", flush=True)
+
+    return 1 if failed else 0
@@ -0,0 +1,149 @@
+import numpy as np
+from functools import partial
+from .progress import timed, array_size
+
+###################
+#                 #
+#  Line Profiles  #
+#                 #
+###################
+def lorentzian(x, Gamma):
+    return (Gamma / np.pi) / (x**2 + Gamma**2)
+
+def gaussian(x, Gamma):
+    # Gamma is the half width at half maximum, as for the Lorentzian
+    sigma = Gamma / np.sqrt(2 * np.log(2))
+    
+    return np.exp(-x**2 / (2 * sigma**2)) / (sigma * np.sqrt(2 * np.pi))
+
+def voigt(x, Gamma, Sigma):
+    try:
+        from scipy.special import voigt_profile
+    except ImportError:
+        raise ImportError("The Voigt profile requires scipy.") from None
+    
+    return voigt_profile(x, Sigma, Gamma)
+
+def line_shape(x, Gamma, profile='lorentzian', Sigma=None):
+    if profile == 'lorentzian':
+        return lorentzian(x, Gamma)
+    if profile == 'gaussian':
+        return gaussian(x, Gamma)
+    if profile == 'voigt':
+        if Sigma is None:
+            raise ValueError("The Voigt profile requires the Gaussian width Sigma.")
+        return voigt(x, Gamma, Sigma)
+    
+    raise ValueError(f"Unknown profile: {profile!r}. Use 'lorentzian', 'gaussian' or 'voigt'.")
+
+def line_reach(Gamma, tol, profile='lorentzian', Sigma=None):
+    # distance from the center beyond which the line shape stays below tol of its peak
+    Gamma = np.asarray(Gamma, dtype=float)
+    if profile == 'lorentzian':
+        return Gamma * np.sqrt(max(1 / tol - 1, 0))
+    if profile == 'gaussian':
+        return Gamma * np.sqrt(max(np.log(1 / tol), 0) / np.log(2))
+    
+    # no closed form: the profile falls off monotonically, so bracket the crossing and bisect
+    peak = line_shape(np.zeros_like(Gamma), Gamma, profile, Sigma)
+    lo, hi = np.zeros_like(Gamma), np.maximum(Gamma, Sigma or 0) + 0.0
+    while np.any(line_shape(hi, Gamma, profile, Sigma) > tol * peak):
+        hi = np.where(line_shape(hi, Gamma, profile, Sigma) > tol * peak, 2 * hi, hi)
+    for _ in range(60):
+        mid = (lo + hi) / 2
+        above = line_shape(mid, Gamma, profile, Sigma) > tol * peak
+        lo, hi = np.where(above, mid, lo), np.where(above, hi, mid)
+        
+    return hi
+
+####################
+#                  #
+#  Width Profiles  #
+#                  #
+####################
+def arctan_width(E, Gamma_0, Gamma_1, E_0, E_w):
+    return Gamma_0 + (Gamma_1 - Gamma_0) * (0.5 + np.arctan((E - E_0) / E_w) / np.pi)
+
+def step_width(E, Gamma_0, Gamma_1, E_0):
+    return np.where(E < E_0, Gamma_0, Gamma_1)
+
+def arctan_gamma(Gamma_0, Gamma_1, E_0, E_w):
+    # width rising from Gamma_0 to Gamma_1 around E_0 over E_w; usable wherever a Gamma is accepted
+    return partial(arctan_width, Gamma_0=Gamma_0, Gamma_1=Gamma_1, E_0=E_0, E_w=E_w)
+
+def step_gamma(Gamma_0, Gamma_1, E_0):
+    return partial(step_width, Gamma_0=Gamma_0, Gamma_1=Gamma_1, E_0=E_0)
+
+def gamma_at(Gamma, E):
+    # a width may be a number or a function of the transition energy
+    if callable(Gamma):
+        return np.asarray(Gamma(np.asarray(E, dtype=float)), dtype=float)
+    
+    return Gamma
+
+#############################
+#                           #
+#  Energy Loss Broadening   #
+#                           #
+#############################
+
+def loss_sticks_fft(w_los, Delta, S, Gamma_f, profile='lorentzian', Sigma=None):
+    # sticks binned linearly onto the (extended) uniform loss grid, then one FFT convolution per map
+    w_los = np.asarray(w_los, dtype=float)
+
+    if len(w_los) < 2:
+        raise ValueError("FFT broadening requires at least two loss energies.")
+    if w_los[1] < w_los[0]:
+        return loss_sticks_fft(w_los[::-1], Delta, S, Gamma_f, profile, Sigma)[::-1]
+
+    step = w_los[1] - w_los[0]
+    if not np.allclose(np.diff(w_los), step, rtol=1e-6, atol=0):
+        raise ValueError("FFT broadening requires a uniform w_los grid.")
+
+    k0 = min(0, int(np.floor((np.min(Delta, initial=w_los[0]) - w_los[0]) / step)))
+    k1 = max(len(w_los) - 1, int(np.ceil((np.max(Delta, initial=w_los[-1]) - w_los[0]) / step)))
+    M = k1 - k0 + 2
+
+    pos = (Delta - w_los[0]) / step - k0
+    i0 = np.floor(pos).astype(int)
+    frac = pos - i0
+
+    binned = np.zeros((M, S.shape[0]))
+    np.add.at(binned, i0, (1 - frac)[:, None] * S.T)
+    np.add.at(binned, i0 + 1, frac[:, None] * S.T)
+
+    kernel = line_shape(np.arange(-(M - 1), M) * step, Gamma_f, profile, Sigma)
+    nfft = 1 << int(np.ceil(np.log2(3 * M - 2)))
+    conv = np.fft.irfft(np.fft.rfft(binned, nfft, axis=0) * np.fft.rfft(kernel, nfft)[:, None], nfft, axis=0)
+
+    return conv[M - 1 - k0 : M - 1 - k0 + len(w_los)]
+
+@timed('broadening')
+def loss_conv(w_inc, w_los, Delta, S, Gamma_f=2, FFT=False, profile='lorentzian', Sigma=None):
+    # S[i, ..., p] is the intensity of (g,f) pair p at w_inc[i]; returns (..., w_los, w_inc) maps
+    w_inc = np.asarray(w_inc, dtype=float)
+    w_los = np.asarray(w_los, dtype=float)
+    Delta = np.asarray(Delta, dtype=float)
+    S = np.asarray(S, dtype=float)
+    extra = S.shape[1:-1] if S.ndim > 2 else ()
+    S = S.reshape(int(np.prod(S.shape[:-1])), len(Delta))
+
+    Gamma_f = gamma_at(Gamma_f, Delta)
+
+    if FFT:
+        if np.ndim(Gamma_f) > 0:
+            raise ValueError("FFT broadening requires a constant Gamma_f.")
+        I = loss_sticks_fft(w_los, Delta, S, Gamma_f, profile, Sigma)
+    else:
+        K = line_shape(Delta[None, :] - w_los[:, None], Gamma_f, profile, Sigma)
+        I = K @ S.T
+        array_size('line_shape', K)
+
+    I = I.reshape((len(w_los), len(w_inc)) + extra)
+    I = np.moveaxis(I, (0, 1), (-2, -1))
+
+    return I * (w_inc[None, :] - w_los[:, None]) / w_inc[None, :]
+
+def stick_conv(sticks, w_los, Gamma_f=2, FFT=False, profile='lorentzian', Sigma=None):
+    # broadens a stick map from the *_sticks functions; only this stage depends on w_los and Gamma_f
+    return loss_conv(sticks['w_inc'], w_los, sticks['Delta'], sticks['S'], Gamma_f, FFT, profile, Sigma)
@@ -0,0 +1,122 @@
+import numpy as np
+from .broadening import loss_conv
+from .rixs_engine import rixs_columns
+from .progress import progress
+
+##########################
+#                        #
+#  Reusable Calculation  #
+#                        #
+##########################
+class RixsCalc:
+    # a planned calculation (prepared data, per-energy function and its arguments) that caches the stick
+    # column of every incident energy it has computed; maps on new or extended grids only compute missing columns
+    def __init__(self, prep, func, args=(), Gamma_f=2, FFT=False, profile='lorentzian', Sigma=None, workers=None, executor=None, inc_window=None, los_window=None):
+        self.prep, self.func, self.args = prep, func, tuple(args)
+        self.Gamma_f, self.FFT, self.profile, self.Sigma = Gamma_f, FFT, profile, Sigma
+        self.workers, self.executor = workers, executor
+
+        # screening (n_window) and pruning (los_tol) are only valid inside the energy ranges they were made for
+        self.inc_window = None if inc_window is None else (float(np.min(inc_window)), float(np.max(inc_window)))
+        self.los_window = None if los_window is None else (float(np.min(los_window)), float(np.max(los_window)))
+
+        self.w_inc = np.zeros(0)
+        self.S = None
+
+    @property
+    def Delta(self):
+        return self.prep['Delta']
+
+    @property
+    def check(self):
+        # the DE_g,f consistency report of rixs_prepare
+        return self.prep.get('check')
+
+    def lookup(self, w_inc, atol=1e-9):
+        # position of each energy in the cache, -1 where it has not been computed
+        index = np.full(len(w_inc), -1)
+
+        if len(self.w_inc):
+            k = np.searchsorted(self.w_inc, w_inc)
+            for near in (np.clip(k - 1, 0, len(self.w_inc) - 1), np.clip(k, 0, len(self.w_inc) - 1)):
+                index = np.where((index < 0) & (np.abs(self.w_inc[near] - w_inc) <= atol), near, index)
+
+        return index
+
+    def columns(self, w_inc):
+        # S[i, ..., p] at w_inc[i]; energies not in the cache are computed and added to it
+        w_inc = np.atleast_1d(np.asarray(w_inc, dtype=float))
+
+        if self.inc_window is not None and len(w_inc) and (np.min(w_inc) < self.inc_window[0] or np.max(w_inc) > self.inc_window[1]):
+            raise ValueError(f"Incident energies outside the screened window {self.inc_window}. Plan with a wider w_inc or without n_window.")
+
+        new = np.unique(w_inc[self.lookup(w_inc) < 0])
+        if len(new):
+            S = rixs_columns(self.func, new, self.prep, self.args, self.workers, self.executor)
+            w_all = np.concatenate([self.w_inc, new])
+            order = np.argsort(w_all, kind='stable')
+            self.w_inc = w_all[order]
+            self.S = (S if self.S is None else np.concatenate([self.S, S]))[order]
+
+        if self.S is None:
+            return np.zeros((0, len(self.Delta)))
+
+        return self.S[self.lookup(w_inc)]
+
+    def sticks(self, w_inc):
+        # the stick map of the *_sticks functions, from the cache
+        return {
+            'w_inc': np.asarray(w_inc, dtype=float),
+            'Delta': self.Delta,
+            'g': self.prep['g'][self.prep['pg']], 'f': self.prep['f'][self.prep['pf']],
+            'S': self.columns(w_inc),
+            'check': self.check,
+            'bound': self.prep.get('bound'),
+        }
+
+    def map(self, w_inc, w_los):
+        # the map of the *_conv functions; only the loss broadening depends on w_los, so new loss points need no new columns
+        I = self.loss_map(w_inc, w_los)
+        progress('finished', "Finished!")
+
+        return I
+
+    def loss_map(self, w_inc, w_los):
+        w_los = np.asarray(w_los, dtype=float)
+
+        if self.los_window is not None and len(w_los) and (np.min(w_los) < self.los_window[0] or np.max(w_los) > self.los_window[1]):
+            raise ValueError(f"Loss energies outside the pruned window {self.los_window}. Plan with a wider w_los or without los_tol.")
+
+        return loss_conv(w_inc, w_los, self.Delta, self.columns(w_inc), self.Gamma_f, self.FFT, self.profile, self.Sigma)
+
+    def refine(self, w_inc, w_los, tol=1e-2, max_iter=8):
+        # adds incident energies at the midpoints of intervals where the map departs from linear interpolation
+        # by more than tol of its maximum, interval by interval, until none does (or after max_iter passes)
+        w_inc = np.unique(np.asarray(w_inc, dtype=float))
+        w_los = np.asarray(w_los, dtype=float)
+        I = self.loss_map(w_inc, w_los)
+        scale = max(np.max(np.abs(I), initial=0), 1e-300)
+
+        left = np.arange(len(w_inc) - 1)
+        for _ in range(max_iter):
+            if len(left) == 0:
+                break
+
+            mid = 0.5 * (w_inc[left] + w_inc[left + 1])
+            I_mid = self.loss_map(mid, w_los)
+            error = np.max(np.abs(I_mid - 0.5 * (I[..., left] + I[..., left + 1])), axis=tuple(range(I.ndim - 1))) / scale
+
+            w_inc = np.concatenate([w_inc, mid])
+            I = np.concatenate([I, I_mid], axis=-1)
+            order = np.argsort(w_inc, kind='stable')
+            w_inc, I = w_inc[order], I[..., order]
+
+            # both halves of an interval that failed are tested again on the next pass
+            rank = np.argsort(order)
+            failed = rank[len(order) - len(mid):][error > tol]
+            left = np.sort(np.concatenate([failed - 1, failed]))
+            progress('refining', f"Refining: {len(w_inc)} incident energies, {len(failed)} intervals above tolerance")
+
+        progress('finished', "Finished!")
+        
+        return w_inc, I
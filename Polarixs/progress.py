@@ -0,0 +1,117 @@
+import time
+import logging
+import warnings
+from functools import wraps
+from contextlib import contextmanager
+
+##############
+#            #
+#  Progress  #
+#            #
+##############
+logger = logging.getLogger('Polarixs')
+logger.addHandler(logging.NullHandler())
+
+_callback = None
+
+def set_progress(callback=None):
+    # callback(event, message, info) receives every status update; None (the default) keeps Polarixs silent
+    global _callback
+    _callback = callback
+
+def console_progress(event, message, info):
+    # the classic one-line console display
+    if event in ('prepare', 'processing'):
+        print(f"\r{message}", end='', flush=True)
+    elif event == 'finished':
+        print(f"\r{message}          ", flush=True)
+    else:
+        print(f"\r{message}", flush=True)
+
+def progress(event, message, level=logging.INFO, **info):
+    # events: 'prepare', 'processing' (with fraction), 'weighting', 'screening', 'pruning', 'refining', 'finished',
+    # 'parsed' and 'job' (batch runner); 'warning' comes from warn
+    if logger.isEnabledFor(level):
+        logger.log(level, message)
+    if _callback is not None:
+        _callback(event, message, info)
+
+def warn(message, **info):
+    # real problems are not silenced with the progress: a RuntimeWarning, and the 'warning' event for the callback
+    warnings.warn(message, RuntimeWarning, stacklevel=2)
+    if _callback is not None:
+        _callback('warning', message, info)
+
+###############
+#             #
+#  Profiling  #
+#             #
+###############
+class Stats:
+    # wall time and calls per stage, counts (transitions, (g,n,f) triples, (g,f) pairs, ...) and largest arrays in bytes
+    def __init__(self):
+        self.time = {}
+        self.calls = {}
+        self.counts = {}
+        self.arrays = {}
+
+    def as_dict(self):
+        return {'time': dict(self.time), 'calls': dict(self.calls), 'counts': dict(self.counts), 'arrays': dict(self.arrays)}
+
+    def __repr__(self):
+        lines = [f"{name:<14} {self.time[name]:9.4f} s  ({self.calls[name]} calls)" for name in self.time]
+        lines += [f"{name:<14} {value}" for name, value in self.counts.items()]
+        lines += [f"{name:<14} {value / 2**20:9.2f} MB" for name, value in self.arrays.items()]
+
+        return "Stats:\n  " + "\n  ".join(lines)
+
+_active = []
+
+@contextmanager
+def profiling():
+    # with profiling() as stats: ... collects the stages of every Polarixs call made in the block
+    stats = Stats()
+    _active.append(stats)
+    try:
+        yield stats
+    finally:
+        _active.remove(stats)
+
+@contextmanager
+def stage(name):
+    if not _active:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        for stats in _active:
+            stats.time[name] = stats.time.get(name, 0.0) + elapsed
+            stats.calls[name] = stats.calls.get(name, 0) + 1
+
+def timed(name):
+    # runs the whole function as one stage
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def count(name, value):
+    # the last value of a count is kept
+    for stats in _active:
+        stats.counts[name] = int(value)
+
+def array_size(name, *arrays):
+    # the largest total size seen for name
+    if not _active:
+        return
+
+    size = sum(getattr(a, 'nbytes', 0) for a in arrays)
+    for stats in _active:
+        stats.arrays[name] = max(stats.arrays.get(name, 0), size)
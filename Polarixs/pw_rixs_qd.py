@@ -1,23 +1,31 @@
 import numpy as np
+from .transitions import as_transitions
+from .calculation import RixsCalc
+from .progress import progress
+from .rixs_engine import group_by_n, tensor_delta, qd_amplitudes, qd_prepare, rixs_resonance, rixs_incoherent, stick_map, rixs_map, rixs_thermal, rixs_prune, rixs_screen, pol_channels
 
 def pw_qd_tensor(Tgn, Tnf, filterinl=np.diag([1, 1, 1]), filterinr=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1])):
     tensor = {}
+    Tgn, Tnf = as_transitions(Tgn), as_transitions(Tnf)
+    t_gn, t_nf = qd_amplitudes(Tgn, Tnf, filterinl, filterinr, filterout)
+    nf_groups = group_by_n(Tnf)
 
-    for [w_gn, XXgn, XYgn, XZgn, YYgn, YZgn, ZZgn, in1, in2] in Tgn: # loop g states
+    for r, (in1, in2) in enumerate(zip(Tgn.i.tolist(), Tgn.j.tolist())): # loop g states
         
-        matching_nf = [row for row in Tnf if row[-1].real == in2.real] # match n states
+        matching_nf = nf_groups.get(in2, []) # match n states
         
-        for [w_nf, Xnf, Ynf, Znf, out1, out2] in matching_nf: 
-            t_gn = filterinl @ np.array([[XXgn, XYgn, XZgn], [XYgn, YYgn, YZgn], [XZgn, YZgn, ZZgn]]) @ filterinr
-            t_nf = filterout @ np.array([Xnf, Ynf, Znf]).conj()
-            t_gnf = t_gn[:, :, None] * t_nf[None, None, :]
+        for s in matching_nf:
+            t_gnf = t_gn[r][:, :, None] * t_nf[s][None, None, :]
                         
-            tensor[(int(in1.real), int(in2.real), int(out1.real))] = (w_gn, w_nf, t_gnf)
+            tensor[(in1, in2, int(Tnf.i[s]))] = (Tgn.E[r], Tnf.E[s], t_gnf)
             
     return tensor
 
-def pw_qd_approx(wi, tensor, Gamma_n):
+def pw_qd_approx(wi, tensor, Gamma_n, table=None):
+    # table: the (g,f) -> DE_g,f table of tensor_delta(tensor); pass it to skip the energy check at every wi
     data = []
+    if table is None:
+        table = tensor_delta(tensor)[0]
     
     max_g = max(g for (g, n, f) in tensor)
     max_n = max(n for (g, n, f) in tensor)
@@ -26,7 +34,6 @@ def pw_qd_approx(wi, tensor, Gamma_n):
     for g in range(1, max_g+1):
         for f in range(1, max_f+1):
             I = 0
-            Delta = []
             
             for n in range(1, max_n+1):
                 try:
@@ -35,31 +42,34 @@ def pw_qd_approx(wi, tensor, Gamma_n):
                     continue
                     
                 I = I + np.sum(np.abs(t_gnf)**2) / (((wi - w_gn)**2 + Gamma_n**2) * 27)
-                Delta.append((w_gn - w_nf).real)
             
-            if Delta:
-                if np.var(Delta) >= 1e-8:
-                    print(f"Error: Not Matched DE_g,f! State Index: g={g}, f={f}")
-                data.append([np.average(Delta), I.real])
+            if (g, f) in table:
+                data.append([table[(g, f)], I.real])
             
     return np.vstack(data)
 
-def pw_qd_ang_intf(wi, tensor, Gamma_n, theta, phii = 0, phio = None):
+def pw_qd_dep(theta, phii=0, phio=None):
+    if phio is None:
+        dep = np.sin(2*theta*np.pi/180)**2 * np.sin(phii*np.pi/180)**2 + 1
+    else:
+        dep = 2 * (np.cos(2*theta*np.pi/180) * np.cos(phii*np.pi/180) * np.cos(phio*np.pi/180) + np.sin(phii*np.pi/180) * np.sin(phio*np.pi/180))**2 + 2 * np.sin(2*theta*np.pi/180)**2 * np.cos(phio*np.pi/180)**2
+        
+    return dep
+
+def pw_qd_ang_intf(wi, tensor, Gamma_n, theta, phii = 0, phio = None, table=None):
     data = []
+    if table is None:
+        table = tensor_delta(tensor)[0]
     
     max_g = max(g for (g, n, f) in tensor)
     max_n = max(n for (g, n, f) in tensor)
     max_f = max(f for (g, n, f) in tensor)
     
-    if phio is None:
-        dep = np.sin(2*theta*np.pi/180)**2 * np.sin(phii*np.pi/180)**2 + 1
-    else:
-        dep = 2 * (np.cos(2*theta*np.pi/180) * np.cos(phii*np.pi/180) * np.cos(phio*np.pi/180) + np.sin(phii*np.pi/180) * np.sin(phio*np.pi/180))**2 + 2 * np.sin(2*theta*np.pi/180)**2 * np.cos(phio*np.pi/180)**2
+    dep = pw_qd_dep(theta, phii, phio)
 
     for g in range(1, max_g+1):
         for f in range(1, max_f+1):
             SumT = np.zeros([3, 3, 3], dtype=complex)
-            Delta = []
             
             for n in range(1, max_n+1):
                 try:
@@ -68,7 +78,6 @@ def pw_qd_ang_intf(wi, tensor, Gamma_n, theta, phii = 0, phio = None):
                     continue
                     
                 SumT = SumT + t_gnf / (wi - w_gn + Gamma_n * 1j)
-                Delta.append((w_gn - w_nf).real)
 
             T1 = np.einsum('ijk,ijk->', SumT.conjugate(), SumT)
             T2 = np.einsum('ijk,ikj->', SumT.conjugate(), SumT)
@@ -77,33 +86,80 @@ def pw_qd_ang_intf(wi, tensor, Gamma_n, theta, phii = 0, phio = None):
             B = (-10*T1 + 15*T2 + 15*T3) / 210
             I = A + B * dep
                        
-            if Delta:
-                if np.var(Delta) >= 1e-8:
-                    print(f"Error: Not Matched DE_g,f! State Index: g={g}, f={f}")
-                data.append([np.average(Delta), I.real])
+            if (g, f) in table:
+                data.append([table[(g, f)], I.real])
             
     return np.vstack(data)
 
-def pw_qd_conv(w_inc, w_los, Tgn, Tnf, Gamma_n=2, Gamma_f=2, AngDep=True, theta=45, phii=0, phio=None, filterinl=np.diag([1, 1, 1]), filterinr=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1])):
-    I = np.zeros((len(w_los), len(w_inc))) 
+def pw_qd_approx_gemm(wi, prep, Gamma_n):
+    return rixs_incoherent(wi, prep, Gamma_n) / 27
+
+def pw_qd_invariant_gemm(wi, prep, Gamma_n):
+    SumT = rixs_resonance(wi, prep, Gamma_n).reshape(-1, 3, 3, 3)
+
+    T1 = np.einsum('pijk,pijk->p', SumT.conjugate(), SumT)
+    T2 = np.einsum('pijk,pikj->p', SumT.conjugate(), SumT)
+    T3 = np.einsum('pijj,pikk->p', SumT.conjugate(), SumT)
+    A = (16*T1 - 10*T2 - 10*T3) / 210
+    B = (-10*T1 + 15*T2 + 15*T3) / 210
     
-    print("\rConverting Data...", end='', flush=True)
-    tensor = pw_qd_tensor(Tgn, Tnf, filterinl, filterinr, filterout)
-
-    for i, wi in enumerate(w_inc):
-        if AngDep:
-            inf_result = pw_qd_ang_intf(wi, tensor, Gamma_n, theta, phii, phio)
-        else:
-            inf_result = pw_qd_approx(wi, tensor, Gamma_n)
-            
-        Delta = inf_result[:, 0]
-        Intensity = inf_result[:, 1]
+    return np.stack([A.real, B.real])
+
+def pw_qd_ang_gemm(wi, prep, Gamma_n, dep):
+    A, B = pw_qd_invariant_gemm(wi, prep, Gamma_n)
+    
+    return A + B * dep
+
+def pw_qd_channel_gemm(wi, prep, Gamma_n, K):
+    # K[c] = [1, dep_c]: one invariant pass serves every (phii, phio) channel
+    return K @ pw_qd_invariant_gemm(wi, prep, Gamma_n)
+
+def pw_qd_plan(w_inc, Tgn, Tnf, Gamma_n=2, AngDep=True, theta=45, phii=0, phio=None, filterinl=np.diag([1, 1, 1]), filterinr=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1]), channels=None, n_window=None, amp_tol=0, w_los=None, Gamma_f=2, los_tol=0, temperature=None, weights=None, pop_tol=1e-4, profile='lorentzian', Sigma=None):
+    # prepared amplitudes and the per-energy intensity function with its arguments
+    progress('prepare', "Converting Data...")
+    prep = rixs_prune(rixs_thermal(qd_prepare(Tgn, Tnf, filterinl, filterinr, filterout), temperature, weights, pop_tol), w_los, Gamma_f, los_tol, profile, Sigma)
+    prep = rixs_screen(prep, w_inc, Gamma_n, n_window, amp_tol)
+
+    if channels is not None:
+        dep = np.array([pw_qd_dep(theta, phii, phio) for phii, phio in pol_channels(channels)])
+        return prep, pw_qd_channel_gemm, (Gamma_n, np.stack([np.ones_like(dep), dep], axis=1))
+    if AngDep:
+        return prep, pw_qd_ang_gemm, (Gamma_n, pw_qd_dep(theta, phii, phio))
         
-        for j, loss in enumerate(w_los): 
-            conv = Intensity * (Gamma_f / np.pi) / ((Delta - loss)**2 + Gamma_f**2)
-            I[j, i] = ((wi - loss) / wi) * np.sum(conv)
+    return prep, pw_qd_approx_gemm, (Gamma_n,)
+
+def pw_qd_sticks(w_inc, Tgn, Tnf, Gamma_n=2, AngDep=True, theta=45, phii=0, phio=None, filterinl=np.diag([1, 1, 1]), filterinr=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1]), workers=None, executor=None, channels=None, n_window=None, amp_tol=0, w_los=None, Gamma_f=2, los_tol=0, temperature=None, weights=None, pop_tol=1e-4, profile='lorentzian', Sigma=None):
+    # unbroadened (Delta, intensity) sticks per incident energy; w_los, Gamma_f, los_tol, profile and Sigma are only used for pruning
+    prep, func, args = pw_qd_plan(w_inc, Tgn, Tnf, Gamma_n, AngDep, theta, phii, phio, filterinl, filterinr, filterout, channels, n_window, amp_tol, w_los, Gamma_f, los_tol, temperature, weights, pop_tol, profile, Sigma)
         
-        print(f"\rProcessing: {i / len(w_inc) * 100:.2f}% ", end='', flush=True)
-    print("\rFinished!          ", flush=True) 
+    return stick_map(func, w_inc, prep, args, workers, executor)
+
+def pw_qd_conv(w_inc, w_los, Tgn, Tnf, Gamma_n=2, Gamma_f=2, AngDep=True, theta=45, phii=0, phio=None, filterinl=np.diag([1, 1, 1]), filterinr=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1]), FFT=False, workers=None, executor=None, channels=None, n_window=None, amp_tol=0, los_tol=0, max_memory=None, out=None, temperature=None, weights=None, pop_tol=1e-4):
+    prep, func, args = pw_qd_plan(w_inc, Tgn, Tnf, Gamma_n, AngDep, theta, phii, phio, filterinl, filterinr, filterout, channels, n_window, amp_tol, w_los, Gamma_f, los_tol, temperature, weights, pop_tol)
+    I = rixs_map(func, w_inc, w_los, prep, args, Gamma_f, FFT, workers=workers, executor=executor, max_memory=max_memory, out=out)
+    progress('finished', "Finished!")
+    
+    return I
+
+def pw_qd_calc(w_inc, w_los, Tgn, Tnf, Gamma_n=2, Gamma_f=2, AngDep=True, theta=45, phii=0, phio=None, filterinl=np.diag([1, 1, 1]), filterinr=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1]), FFT=False, workers=None, executor=None, channels=None, n_window=None, amp_tol=0, los_tol=0, temperature=None, weights=None, pop_tol=1e-4, profile='lorentzian', Sigma=None):
+    prep, func, args = pw_qd_plan(w_inc, Tgn, Tnf, Gamma_n, AngDep, theta, phii, phio, filterinl, filterinr, filterout, channels, n_window, amp_tol, w_los, Gamma_f, los_tol, temperature, weights, pop_tol, profile, Sigma)
+
+    return RixsCalc(prep, func, args, Gamma_f, FFT, profile, Sigma, workers=workers, executor=executor, inc_window=None if n_window is None else w_inc, los_window=w_los if los_tol else None)
+
+def pw_qd_invariants(w_inc, w_los, Tgn, Tnf, Gamma_n=2, Gamma_f=2, filterinl=np.diag([1, 1, 1]), filterinr=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1]), FFT=False, workers=None, executor=None, n_window=None, amp_tol=0, los_tol=0, max_memory=None, out=None, temperature=None, weights=None, pop_tol=1e-4):
+    # isotropic and anisotropic maps: any geometry is IA + pw_qd_dep(theta, phii, phio) * IB
+    progress('prepare', "Converting Data...")
+    prep = rixs_prune(rixs_thermal(qd_prepare(Tgn, Tnf, filterinl, filterinr, filterout), temperature, weights, pop_tol), w_los, Gamma_f, los_tol)
+    prep = rixs_screen(prep, w_inc, Gamma_n, n_window, amp_tol)
+
+    IA, IB = rixs_map(pw_qd_invariant_gemm, w_inc, w_los, prep, (Gamma_n,), Gamma_f, FFT, workers=workers, executor=executor, max_memory=max_memory, out=out)
+    progress('finished', "Finished!")
+    
+    return IA, IB
+
+def pw_qd_scan(w_inc, w_los, Tgn, Tnf, Gamma_n=2, Gamma_f=2, theta=45, phii=0, phio=None, filterinl=np.diag([1, 1, 1]), filterinr=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1]), FFT=False, workers=None, executor=None, n_window=None, amp_tol=0, los_tol=0, max_memory=None, temperature=None, weights=None, pop_tol=1e-4):
+    # theta, phii and phio may be arrays (broadcast together); returns one map per geometry
+    IA, IB = pw_qd_invariants(w_inc, w_los, Tgn, Tnf, Gamma_n, Gamma_f, filterinl, filterinr, filterout, FFT, workers, executor, n_window, amp_tol, los_tol, max_memory, None, temperature, weights, pop_tol)
+    dep = np.asarray(pw_qd_dep(np.asarray(theta, dtype=float), np.asarray(phii, dtype=float), phio if phio is None else np.asarray(phio, dtype=float)))
     
-    return I
\ No newline at end of file
+    return IA + dep[..., None, None] * IB
@@ -0,0 +1,674 @@
+import os
+import logging
+import multiprocessing
+import numpy as np
+from collections import namedtuple
+from multiprocessing import shared_memory, resource_tracker
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from .broadening import gamma_at, line_reach, loss_conv
+from .transitions import as_transitions
+from .progress import progress, warn, timed, count, array_size
+
+#########################
+#                       #
+#  Intermediate States  #
+#                       #
+#########################
+def group_by_n(T):
+    # row numbers of T keyed by their |n> index, in their original order
+    groups = {}
+    
+    for k, n in enumerate(as_transitions(T).j.tolist()):
+        groups.setdefault(n, []).append(k)
+        
+    return groups
+
+########################
+#                      #
+#  Energy Consistency  #
+#                      #
+########################
+DE_TOL = 1e-4   # eV, spread of w_gn - w_nf over the n states linking a (g, f) pair
+
+def energy_check(Wgn, Mgn, Wnf, Mnf):
+    # pair count, mean and standard deviation of w_gn - w_nf over the linking n states for all (g, f) at once;
+    # moments are taken relative to one w_gn per n so that the large absolute energies cancel exactly
+    ref = np.max(np.where(Mgn, Wgn, -np.inf), axis=0, initial=-np.inf)
+    ref = np.where(np.isfinite(ref), ref, 0)
+    mg, mf = Mgn.astype(float), Mnf.astype(float)
+    a = np.where(Mgn, Wgn - ref, 0)
+    b = np.where(Mnf, Wnf - ref, 0)
+
+    count = mg @ mf.T
+    mean = (a @ mf.T - mg @ b.T) / np.maximum(count, 1)
+    square = (a**2 @ mf.T - 2 * a @ b.T + mg @ (b**2).T) / np.maximum(count, 1)
+
+    return count.astype(int), mean, np.sqrt(np.maximum(square - mean**2, 0))
+
+def energy_report(g, f, deviation, tol=DE_TOL):
+    # the (g, f) pairs whose DE_g,f differs between n states by tol or more
+    bad = deviation >= tol
+
+    return {
+        'g': g[bad], 'f': f[bad], 'deviation': deviation[bad],
+        'max_deviation': float(np.max(deviation, initial=0)), 'pairs': len(deviation), 'tol': tol,
+    }
+
+def tensor_delta(tensor, tol=DE_TOL):
+    # (g, f) -> DE_g,f table of a (g, n, f) tensor dict and its energy report, computed once for all incident energies
+    keys = np.array(list(tensor), dtype=int).reshape(-1, 3)
+    diff = np.array([np.real(w_gn - w_nf) for (w_gn, w_nf, _) in tensor.values()], dtype=float)
+
+    pairs, inverse = np.unique(keys[:, [0, 2]], axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    count = np.bincount(inverse, minlength=len(pairs))
+    mean = np.bincount(inverse, diff, len(pairs)) / count
+    deviation = np.sqrt(np.bincount(inverse, (diff - mean[inverse])**2, len(pairs)) / count)
+
+    table = dict(zip(map(tuple, pairs.tolist()), mean.tolist()))
+
+    return table, energy_report(pairs[:, 0], pairs[:, 1], deviation, tol)
+
+##########################
+#                        #
+#  Dense Amplitude Data  #
+#                        #
+##########################
+@timed('join')
+def rixs_prepare(Tgn, Tnf, t_gn, t_nf):
+    # Tgn/Tnf are transition sets (|g> or |f> index i, |n> index j); t_gn/t_nf hold one amplitude vector per row
+    Tgn = as_transitions(Tgn)
+    Tnf = as_transitions(Tnf)
+    for name, T in (('g->n', Tgn), ('n->f', Tnf)):
+        if len(T) == 0:
+            raise ValueError(f"The {name} transition table is empty. Check that the reader found its section (e.g. SOC matches the output).")
+    t_gn = np.asarray(t_gn, dtype=complex).reshape(len(Tgn), -1)
+    t_nf = np.asarray(t_nf, dtype=complex).reshape(len(Tnf), -1)
+
+    g, n_g = Tgn.i, Tgn.j
+    f, n_f = Tnf.i, Tnf.j
+
+    # only states reachable through a common n enter the sum
+    keep_gn = (g >= 1) & (n_g >= 1) & np.isin(n_g, n_f[f >= 1])
+    keep_nf = (f >= 1) & (n_f >= 1) & np.isin(n_f, n_g[g >= 1])
+
+    g_states = np.unique(g[keep_gn])
+    n_states = np.unique(n_g[keep_gn])
+    f_states = np.unique(f[keep_nf])
+    G, N, F = len(g_states), len(n_states), len(f_states)
+
+    gi = np.searchsorted(g_states, g[keep_gn])
+    ni_g = np.searchsorted(n_states, n_g[keep_gn])
+    fi = np.searchsorted(f_states, f[keep_nf])
+    ni_f = np.searchsorted(n_states, n_f[keep_nf])
+
+    Agn = np.zeros((G, N, t_gn.shape[1]), dtype=complex)
+    Wgn = np.zeros((G, N))
+    Mgn = np.zeros((G, N), dtype=bool)
+    Agn[gi, ni_g] = t_gn[keep_gn]
+    Wgn[gi, ni_g] = Tgn.E[keep_gn]
+    Mgn[gi, ni_g] = True
+
+    Bnf = np.zeros((N, F, t_nf.shape[1]), dtype=complex)
+    Wnf = np.zeros((F, N))
+    Mnf = np.zeros((F, N), dtype=bool)
+    Bnf[ni_f, fi] = t_nf[keep_nf]
+    Wnf[fi, ni_f] = Tnf.E[keep_nf]
+    Mnf[fi, ni_f] = True
+
+    # energy transfer of each (g, f) pair, averaged over the linking n states
+    count_gf, mean, deviation = energy_check(Wgn, Mgn, Wnf, Mnf)
+    pg, pf = np.nonzero(count_gf)
+    check = energy_report(g_states[pg], f_states[pf], deviation[pg, pf])
+    count('transitions', len(Tgn) + len(Tnf))
+    count('triples', np.sum(count_gf))
+    count('pairs', len(pg))
+    count('n_states', N)
+    array_size('prep', Agn, Wgn, Bnf)
+    if len(check['g']):
+        warn(f"{len(check['g'])} of {check['pairs']} (g,f) pairs have mismatched DE_g,f (max deviation {check['max_deviation']:.2e} eV)", check=check)
+
+    return {
+        'g': g_states, 'n': n_states, 'f': f_states,
+        'Agn': Agn, 'Wgn': Wgn, 'Bnf': Bnf,
+        'pg': pg, 'pf': pf,
+        'Delta': mean[pg, pf],
+        'check': check,
+    }
+
+@timed('tensor')
+def dd_amplitudes(Tgn, Tnf, filterin=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1])):
+    Tgn = as_transitions(Tgn)
+    Tnf = as_transitions(Tnf)
+
+    t_gn = Tgn.M[:, :3] @ np.transpose(filterin)
+    t_nf = Tnf.M[:, :3].conj() @ np.transpose(filterout)
+
+    return t_gn, t_nf
+
+@timed('tensor')
+def qd_amplitudes(Tgn, Tnf, filterinl=np.diag([1, 1, 1]), filterinr=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1])):
+    Tgn = as_transitions(Tgn)
+    Tnf = as_transitions(Tnf)
+
+    XX, XY, XZ, YY, YZ, ZZ = Tgn.M[:, :6].T
+    Q = np.stack([XX, XY, XZ, XY, YY, YZ, XZ, YZ, ZZ], axis=1).reshape(-1, 3, 3)
+    t_gn = filterinl @ Q @ filterinr
+    t_nf = Tnf.M[:, :3].conj() @ np.transpose(filterout)
+
+    return t_gn, t_nf
+
+def dd_prepare(Tgn, Tnf, filterin=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1])):
+    Tgn, Tnf = as_transitions(Tgn), as_transitions(Tnf)
+    
+    return rixs_prepare(Tgn, Tnf, *dd_amplitudes(Tgn, Tnf, filterin, filterout))
+
+def qd_prepare(Tgn, Tnf, filterinl=np.diag([1, 1, 1]), filterinr=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1])):
+    Tgn, Tnf = as_transitions(Tgn), as_transitions(Tnf)
+    t_gn, t_nf = qd_amplitudes(Tgn, Tnf, filterinl, filterinr, filterout)
+    
+    return rixs_prepare(Tgn, Tnf, t_gn.reshape(-1, 9), t_nf)
+
+def int_prepare(Tgn, Tnf):
+    # intensities enter as |t|^2, so sqrt|I| reproduces |I_gn * I_nf| in rixs_incoherent
+    Tgn = as_transitions(Tgn)
+    Tnf = as_transitions(Tnf)
+
+    return rixs_prepare(Tgn, Tnf, np.sqrt(np.abs(Tgn.M[:, 0])), np.sqrt(np.abs(Tnf.M[:, 0])))
+
+#########################
+#                       #
+#  Thermal Populations  #
+#                       #
+#########################
+K_B = 8.617333262e-5    # eV/K
+
+def boltzmann(E, temperature):
+    # normalized populations of states at energies E (eV); at temperature 0 the lowest states share it equally
+    E = np.asarray(E, dtype=float)
+    if E.size == 0:
+        raise ValueError("No states to populate.")
+    E = E - np.min(E)
+
+    if temperature < 0:
+        raise ValueError(f"The temperature must be positive, got {temperature}.")
+    if temperature == 0:
+        p = (E < 1e-6).astype(float)
+    else:
+        p = np.exp(-E / (K_B * temperature))
+
+    if not np.sum(p) > 0:
+        raise ValueError(f"No state is populated at {temperature} K.")
+
+    return p / np.sum(p)
+
+def thermal_weights(eigenvalues, temperature, GStates=None):
+    # {g: population} from the state energies of Molcas_eigenE (rows [state, au, eV, cm-1]), over GStates (default: all states)
+    eigenvalues = np.asarray(eigenvalues, dtype=float).reshape(-1, 4)
+    states, first = np.unique(eigenvalues[:, 0].astype(int), return_index=True)
+    E = eigenvalues[first, 2]
+
+    if GStates:
+        keep = np.isin(states, GStates)
+        states, E = states[keep], E[keep]
+
+    return dict(zip(states.tolist(), boltzmann(E, temperature).tolist()))
+
+def ground_energies(prep):
+    # E_g relative to the first g state, from w_gn = E_n - E_g through the n states shared between g states
+    Wgn = prep['Wgn']
+    
+    return linked_energies(prep['g'], Wgn, (Wgn != 0) | np.any(prep['Agn'] != 0, axis=2))
+
+def linked_energies(g, Wgn, linked):
+    # the same from a dense (g, n) energy table and the mask of the (g, n) pairs it holds
+    G, N = Wgn.shape
+
+    Eg = np.full(G, np.nan)
+    En = np.full(N, np.nan)
+    if G:
+        Eg[0] = 0
+        En[linked[0]] = Wgn[0, linked[0]]
+
+    for _ in range(G):
+        for k in np.flatnonzero(np.isnan(Eg)):
+            shared = linked[k] & ~np.isnan(En)
+            if np.any(shared):
+                Eg[k] = np.mean(En[shared] - Wgn[k, shared])
+                new = linked[k] & np.isnan(En)
+                En[new] = Eg[k] + Wgn[k, new]
+        if not np.any(np.isnan(Eg)):
+            break
+
+    if np.any(np.isnan(Eg)):
+        missing = np.asarray(g)[np.isnan(Eg)].tolist()
+        raise ValueError(f"Ground states {missing} share no n state with the others; pass weights=thermal_weights(Molcas_eigenE(...), temperature) instead.")
+
+    return Eg
+
+def ground_population(g, energies, temperature=None, weights=None):
+    # population of each of the g states; energies() gives their E_g and is only called for a temperature
+    if temperature is not None and weights is not None:
+        raise ValueError("Give either temperature or weights, not both.")
+
+    if weights is None:
+        return boltzmann(energies(), temperature)
+    
+    pop = np.array([weights.get(state, 0.0) for state in np.asarray(g).tolist()], dtype=float)
+    if np.any(pop < 0):
+        raise ValueError("Weights must not be negative.")
+    if not np.sum(pop) > 0:
+        raise ValueError(f"The weights give no population to any of the ground states {np.asarray(g).tolist()}.")
+
+    return pop
+
+def rixs_thermal(prep, temperature=None, weights=None, pop_tol=1e-4):
+    # g states weighted by Boltzmann factors at temperature (K) or by explicit weights {g: weight}; states below
+    # pop_tol of the total are dropped and the rest share one resonance pass, with t_gn scaled by sqrt(weight)
+    if temperature is None and weights is None:
+        return prep
+
+    pop = ground_population(prep['g'], lambda: ground_energies(prep), temperature, weights)
+    keep_g = pop > pop_tol * np.sum(pop)
+    sub = pair_subset(prep, keep_g[prep['pg']])
+    used = np.searchsorted(prep['g'], sub['g'])
+    sub['Agn'] = sub['Agn'] * np.sqrt(pop[used])[:, None, None]
+    sub['population'] = pop[used]
+
+    count('g_states_kept', len(sub['g']))
+    progress('weighting', f"Weighting: kept {len(sub['g'])} of {len(prep['g'])} ground states with population above {pop_tol:g}")
+
+    return sub
+
+###############
+#             #
+#  Screening  #
+#             #
+###############
+def pair_subset(prep, keep):
+    # prepared data restricted to the (g,f) pairs selected by keep; unused g, f and n states are dropped
+    g_used = np.unique(prep['pg'][keep])
+    f_used = np.unique(prep['pf'][keep])
+    Agn = prep['Agn'][g_used]
+    Bnf = prep['Bnf'][:, f_used]
+    keep_n = np.any(Agn != 0, axis=(0, 2)) & np.any(Bnf != 0, axis=(1, 2))
+
+    sub = dict(prep)
+    sub['g'] = prep['g'][g_used]
+    sub['f'] = prep['f'][f_used]
+    sub['n'] = prep['n'][keep_n]
+    sub['Agn'] = Agn[:, keep_n]
+    sub['Wgn'] = prep['Wgn'][g_used][:, keep_n]
+    sub['Bnf'] = Bnf[keep_n]
+    sub['pg'] = np.searchsorted(g_used, prep['pg'][keep])
+    sub['pf'] = np.searchsorted(f_used, prep['pf'][keep])
+    sub['Delta'] = prep['Delta'][keep]
+    if 'bound' in prep:
+        sub['bound'] = prep['bound'][keep]
+    if 'population' in prep:
+        sub['population'] = prep['population'][g_used]
+
+    return sub
+
+@timed('screen')
+def rixs_prune(prep, w_los, Gamma_f, los_tol=0, profile='lorentzian', Sigma=None):
+    # drop (g, f) pairs whose loss line shape is below los_tol of its peak everywhere on w_los,
+    # i.e. Delta farther than line_reach (Gamma_f * sqrt(1/los_tol - 1) for a Lorentzian) from the loss window
+    if not los_tol or w_los is None:
+        return prep
+
+    Delta = prep['Delta']
+    reach = line_reach(np.broadcast_to(gamma_at(Gamma_f, Delta), Delta.shape), los_tol, profile, Sigma)
+    keep = (Delta >= np.min(w_los) - reach) & (Delta <= np.max(w_los) + reach)
+
+    sub = pair_subset(prep, keep)
+    count('pairs_kept', np.sum(keep))
+    progress('pruning', f"Pruning: kept {np.sum(keep)} of {len(keep)} (g,f) pairs and {len(sub['n'])} of {len(prep['n'])} n states")
+
+    return sub
+
+@timed('screen')
+def rixs_screen(prep, w_inc, Gamma_n, n_window=None, amp_tol=0):
+    # drop (g, n) terms farther than n_window * Gamma_n from the incident window, or with
+    # |t_gn| max_f |t_nf| below amp_tol times the largest one; n states left without terms are removed
+    if n_window is None and not amp_tol:
+        return prep
+
+    Agn, Bnf, Wgn = prep['Agn'], prep['Bnf'], prep['Wgn']
+    Gamma_n = gamma_at(Gamma_n, Wgn)
+    a = np.sqrt(np.sum(np.abs(Agn)**2, axis=2))
+    b = np.sqrt(np.sum(np.abs(Bnf)**2, axis=2))
+    present = a > 0
+
+    w_min, w_max = np.min(w_inc), np.max(w_inc)
+    dist = np.maximum(np.maximum(w_min - Wgn, Wgn - w_max), 0)
+
+    drop = np.zeros_like(present)
+    if n_window is not None:
+        drop |= dist > n_window * Gamma_n
+    if amp_tol:
+        peak = a * np.max(b, axis=1, initial=0)[None, :]
+        drop |= peak < amp_tol * np.max(peak, initial=0)
+    drop &= present
+
+    # |sum over dropped n of t_gn t_nf / (wi - w_gn + i*Gamma_n)| for any wi in the incident window
+    bound = (np.where(drop, a / np.hypot(dist, Gamma_n), 0) @ b)[prep['pg'], prep['pf']]
+    scale = np.max(a * np.max(b, axis=1, initial=0)[None, :] / Gamma_n, initial=0)
+
+    keep_n = np.any(present & ~drop, axis=0) & np.any(b > 0, axis=1)
+    info = {
+        'gn_kept': int(np.sum(present & ~drop)), 'gn_total': int(np.sum(present)),
+        'n_kept': int(np.sum(keep_n)), 'n_total': len(keep_n),
+        'bound': bound, 'rel_bound': float(np.max(bound, initial=0) / max(scale, 1e-300)),
+    }
+    count('gn_kept', info['gn_kept'])
+    count('n_states_kept', info['n_kept'])
+    progress('screening', f"Screening: kept {info['gn_kept']} of {info['gn_total']} (g,n) terms and {info['n_kept']} of {info['n_total']} n states, amplitude error <= {info['rel_bound']:.2e} of the largest resonant term", **info)
+
+    prep = dict(prep)
+    prep['Agn'] = np.where(drop[:, :, None], 0, Agn)[:, keep_n]
+    prep['Wgn'] = Wgn[:, keep_n]
+    prep['Bnf'] = Bnf[keep_n]
+    prep['n'] = prep['n'][keep_n]
+    prep['bound'] = bound
+
+    return prep
+
+#######################
+#                     #
+#  Resonance Summing  #
+#                     #
+#######################
+def rixs_resonance(wi, prep, Gamma_n):
+    # SumT[g,f] = sum_n t_gn (x) t_nf / (wi - w_gn + i*Gamma_n) as one matrix product over n per g
+    Agn, Bnf = prep['Agn'], prep['Bnf']
+    G, N, Cg = Agn.shape
+    F, Cf = Bnf.shape[1], Bnf.shape[2]
+
+    Gamma_n = gamma_at(Gamma_n, prep['Wgn'])
+    X = Agn / (wi - prep['Wgn'] + Gamma_n * 1j)[:, :, None]
+    SumT = np.matmul(X.transpose(0, 2, 1), Bnf.reshape(N, F * Cf))
+    SumT = SumT.reshape(G, Cg, F, Cf).transpose(0, 2, 1, 3)
+    array_size('resonance', X, SumT)
+
+    return SumT[prep['pg'], prep['pf']]
+
+def rixs_coherent(wi, prep, Gamma_n, W=None):
+    # |sum_n a_gn b_nf / (wi - w_gn + i*Gamma_n)|^2 for amplitudes already projected to scalars
+    # with W[c, a, b], channel c sums the |.|^2 of projections a (g->n) and b (n->f); W[a, b] is a single channel
+    SumT = rixs_resonance(wi, prep, Gamma_n)
+    
+    if W is None:
+        return np.abs(SumT[:, 0, 0])**2
+    
+    return np.einsum('...ab,pab->...p', W, np.abs(SumT)**2)
+
+def rixs_incoherent(wi, prep, Gamma_n):
+    # sum_n |t_gn|^2 |t_nf|^2 / ((wi - w_gn)^2 + Gamma_n^2), without interference between n states
+    Gamma_n = gamma_at(Gamma_n, prep['Wgn'])
+    Pgn = np.sum(np.abs(prep['Agn'])**2, axis=2) / ((wi - prep['Wgn'])**2 + Gamma_n**2)
+    Pnf = np.sum(np.abs(prep['Bnf'])**2, axis=2)
+
+    return (Pgn @ Pnf)[prep['pg'], prep['pf']]
+
+###########################
+#                         #
+#  Polarization Channels  #
+#                         #
+###########################
+POL_ANGLES = {'pi': 0.0, 'sigma': 90.0}
+
+def pol_channels(channels):
+    # [(phii, phio), ...] with 'pi'/'sigma' as 0/90 degrees; phio=None is a detector without polarization analysis
+    angles = []
+    
+    for channel in channels:
+        if len(channel) != 2:
+            raise ValueError(f"A channel is a (phii, phio) pair, got {channel!r}.")
+        phii, phio = (POL_ANGLES.get(phi, phi) if isinstance(phi, str) else phi for phi in channel)
+        if isinstance(phii, str) or isinstance(phio, str):
+            raise ValueError(f"Unknown polarization in channel {channel!r}. Use an angle, 'sigma' or 'pi'.")
+        if phii is None:
+            raise ValueError("The incident polarization of a channel must be given.")
+        angles.append((float(phii), None if phio is None else float(phio)))
+        
+    return angles
+
+##########################
+#                        #
+#  Incident Energy Loop  #
+#                        #
+##########################
+Shared = namedtuple('Shared', ['name', 'shape', 'dtype'])
+
+_attached = {}
+
+def share_prep(prep):
+    # copy the arrays of prep into shared memory; workers rebuild prep from the returned spec
+    spec, blocks = {}, []
+    
+    for key, value in prep.items():
+        if isinstance(value, np.ndarray) and value.nbytes > 0:
+            shm = shared_memory.SharedMemory(create=True, size=value.nbytes)
+            np.ndarray(value.shape, value.dtype, buffer=shm.buf)[...] = value
+            spec[key] = Shared(shm.name, value.shape, value.dtype.str)
+            blocks.append(shm)
+        else:
+            spec[key] = value
+            
+    return spec, blocks
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # the creating process owns the segment; a forked worker shares its tracker
+        if multiprocessing.get_start_method() != 'fork':
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+def attach_prep(spec):
+    names = {value.name for value in spec.values() if isinstance(value, Shared)}
+    
+    for name in list(_attached):
+        if name not in names:
+            _attached.pop(name).close()
+            
+    prep = {}
+    for key, value in spec.items():
+        if isinstance(value, Shared):
+            if value.name not in _attached:
+                _attached[value.name] = _attach(value.name)
+            prep[key] = np.ndarray(value.shape, np.dtype(value.dtype), buffer=_attached[value.name].buf)
+        else:
+            prep[key] = value
+            
+    return prep
+
+def _column_task(func, spec, w_chunk, args):
+    prep = attach_prep(spec)
+    
+    return np.array([func(wi, prep, *args) for wi in w_chunk])
+
+@timed('resonance')
+def rixs_columns(func, w_inc, prep, args=(), workers=None, executor=None):
+    # S[i] = func(w_inc[i], prep, *args); columns are independent and may run on a thread or process pool
+    if len(w_inc) == 0:
+        return np.zeros((0, len(prep['Delta'])))
+    
+    S = None
+    
+    if workers is None and executor is None:
+        for i, wi in enumerate(w_inc):
+            column = func(wi, prep, *args)
+            if S is None:
+                S = np.zeros((len(w_inc),) + np.shape(column))
+            S[i] = column
+            progress('processing', f"Processing: {i / len(w_inc) * 100:.2f}% ", logging.DEBUG, fraction=i / len(w_inc))
+        array_size('sticks', S)
+        return S
+    
+    if workers is None:
+        workers = os.cpu_count()
+    if executor is None:
+        executor = 'process'
+    
+    if isinstance(executor, Executor):
+        pool, owned = executor, False
+    elif executor == 'process':
+        pool, owned = None, True
+    elif executor == 'thread':
+        pool, owned = ThreadPoolExecutor(max_workers=workers), True
+    else:
+        raise ValueError(f"Unknown executor: {executor!r}. Use 'process', 'thread' or a concurrent.futures.Executor.")
+    
+    if isinstance(pool, ThreadPoolExecutor):
+        spec, blocks = prep, []
+    else:
+        spec, blocks = share_prep(prep)
+        
+    try:
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            
+        chunks = [c for c in np.array_split(np.arange(len(w_inc)), min(len(w_inc), 4 * workers)) if len(c)]
+        futures = {pool.submit(_column_task, func, spec, np.asarray(w_inc)[c], args): c for c in chunks}
+        
+        done = 0
+        for future in as_completed(futures):
+            columns = future.result()
+            if S is None:
+                S = np.zeros((len(w_inc),) + np.shape(columns)[1:])
+            S[futures[future]] = columns
+            done += len(futures[future])
+            progress('processing', f"Processing: {done / len(w_inc) * 100:.2f}% ", logging.DEBUG, fraction=done / len(w_inc))
+    finally:
+        if owned and pool is not None:
+            pool.shutdown()
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+            
+    array_size('sticks', S)
+    return S
+
+def stick_map(func, w_inc, prep, args=(), workers=None, executor=None):
+    # S[i, ..., p]: intensity of (g,f) pair p with energy transfer Delta[p] at w_inc[i], before loss broadening
+    return {
+        'w_inc': np.asarray(w_inc, dtype=float),
+        'Delta': prep['Delta'],
+        'g': prep['g'][prep['pg']], 'f': prep['f'][prep['pf']],
+        'S': rixs_columns(func, w_inc, prep, args, workers, executor),
+        'check': prep.get('check'),
+        'bound': prep.get('bound'),
+    }
+
+##################
+#                #
+#  Tiled Output  #
+#                #
+##################
+def map_output(out, shape):
+    # out may be None, an array of the right shape (e.g. np.memmap) or a path for a new .npy memmap
+    if out is None:
+        return np.zeros(shape)
+    if isinstance(out, (str, os.PathLike)):
+        return np.lib.format.open_memmap(out, mode='w+', dtype=float, shape=shape)
+    if np.shape(out) != shape:
+        raise ValueError(f"out has shape {np.shape(out)}, expected {shape}.")
+    out[...] = 0
+    
+    return out
+
+def pair_tile(prep, gs, fs):
+    # the pairs with g in slice gs and f in slice fs; the prepared arrays are shared as views, not copied
+    keep = (prep['pg'] >= gs.start) & (prep['pg'] < gs.stop) & (prep['pf'] >= fs.start) & (prep['pf'] < fs.stop)
+
+    sub = dict(prep)
+    sub['g'], sub['f'] = prep['g'][gs], prep['f'][fs]
+    sub['Agn'], sub['Wgn'] = prep['Agn'][gs], prep['Wgn'][gs]
+    sub['Bnf'] = prep['Bnf'][:, fs]
+    sub['pg'] = prep['pg'][keep] - gs.start
+    sub['pf'] = prep['pf'][keep] - fs.start
+    sub['Delta'] = prep['Delta'][keep]
+    if 'bound' in prep:
+        sub['bound'] = prep['bound'][keep]
+    if 'population' in prep:
+        sub['population'] = prep['population'][gs]
+
+    return sub
+
+def tile_sizes(G, F, N, n_inc, n_los, E, Cg, Cf, workers, max_memory):
+    # (g rows, f columns, incident, loss) tile under max_memory bytes: stick tile, resonance temporaries per worker
+    # (the g->n quotients, the n->f block and the (g,f) sums), line shapes and product; every (g,f) cell counts as a pair
+    def size(Gc, Fc, Ic, Lc):
+        cells = Gc * Fc
+        return cells * (8 * E * Ic + 48 * Cg * Cf * E * workers + 24 * Lc) + 16 * N * (Gc * Cg + Fc * Cf) * workers + 16 * E * Ic * Lc
+
+    def shrink(Gc, Fc):
+        # whole g rows first, then the f range of a single row
+        return ((Gc + 1) // 2, Fc) if Gc > 1 else (Gc, (Fc + 1) // 2)
+
+    Gc, Fc, Ic, Lc = max(G, 1), max(F, 1), max(n_inc, 1), max(n_los, 1)
+    while size(Gc, Fc, Ic, Lc) > max_memory and Gc * Fc > 256:
+        Gc, Fc = shrink(Gc, Fc)
+    while size(Gc, Fc, Ic, Lc) > max_memory and (Ic > 1 or Lc > 1):
+        if Ic >= Lc:
+            Ic = (Ic + 1) // 2
+        else:
+            Lc = (Lc + 1) // 2
+    while size(Gc, Fc, Ic, Lc) > max_memory and Gc * Fc > 1:
+        Gc, Fc = shrink(Gc, Fc)
+
+    return Gc, Fc, Ic, Lc
+
+def map_tile(func, w_inc, w_los, sub, args, Gamma_f, FFT, profile, Sigma, workers, executor, Ic, Lc, out):
+    # adds the map of the pairs of one (g,f) block to out, in incident and loss tiles
+    for i0 in range(0, len(w_inc), Ic):
+        S = rixs_columns(func, w_inc[i0:i0 + Ic], sub, args, workers, executor)
+        for l0 in range(0, len(w_los), Lc):
+            out[..., l0:l0 + Lc, i0:i0 + Ic] += loss_conv(w_inc[i0:i0 + Ic], w_los[l0:l0 + Lc], sub['Delta'], S, Gamma_f, FFT, profile, Sigma)
+
+def rixs_map(func, w_inc, w_los, prep, args=(), Gamma_f=2, FFT=False, profile='lorentzian', Sigma=None, workers=None, executor=None, max_memory=None, out=None):
+    # resonance sums and loss broadening in one pass, tiled over blocks of g and f states, incident and loss energies
+    if max_memory is None and out is None:
+        return loss_conv(w_inc, w_los, prep['Delta'], rixs_columns(func, w_inc, prep, args, workers, executor), Gamma_f, FFT, profile, Sigma)
+
+    w_inc = np.asarray(w_inc, dtype=float)
+    w_los = np.asarray(w_los, dtype=float)
+    P = len(prep['Delta'])
+    
+    # the axes between w_inc and the pairs (channels, orientations, invariants) from a one-pair probe
+    g0, f0 = (int(prep['pg'][0]), int(prep['pf'][0])) if P else (0, 0)
+    probe = pair_tile(prep, slice(g0, g0 + min(P, 1)), slice(f0, f0 + min(P, 1)))
+    extra = np.shape(func(w_inc[0], probe, *args))[:-1] if len(w_inc) else ()
+    out = map_output(out, extra + (len(w_los), len(w_inc)))
+    
+    E = int(np.prod(extra))
+    G, N, Cg = prep['Agn'].shape
+    F, Cf = prep['Bnf'].shape[1:]
+    n_workers = 1 if workers is None and executor is None else (workers or os.cpu_count())
+    Gc, Fc, Ic, Lc = tile_sizes(G, F, N, len(w_inc), len(w_los), max(E, 1), Cg, Cf, n_workers, np.inf if max_memory is None else max_memory)
+    
+    # one pool serves all tiles
+    owned = None
+    if executor is None and workers is not None:
+        executor = 'process'
+    if executor == 'process':
+        executor = owned = ProcessPoolExecutor(max_workers=n_workers)
+    elif executor == 'thread':
+        executor = owned = ThreadPoolExecutor(max_workers=n_workers)
+        
+    try:
+        for g0 in range(0, G, Gc):
+            for f0 in range(0, F, Fc):
+                sub = pair_tile(prep, slice(g0, min(g0 + Gc, G)), slice(f0, min(f0 + Fc, F)))
+                if len(sub['Delta']):
+                    map_tile(func, w_inc, w_los, sub, args, Gamma_f, FFT, profile, Sigma, workers, executor, Ic, Lc, out)
+    finally:
+        if owned is not None:
+            owned.shutdown()
+    
+    array_size('map', out)
+    return out
@@ -1,23 +1,31 @@
 import numpy as np
+from .transitions import as_transitions
+from .calculation import RixsCalc
+from .progress import progress
+from .rixs_engine import group_by_n, tensor_delta, rixs_prepare, dd_amplitudes, dd_prepare, rixs_resonance, rixs_coherent, stick_map, rixs_map, rixs_thermal, rixs_prune, rixs_screen, pol_channels
 
 def sc_dd_tensor(Tgn, Tnf, R, filterin=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1])):
     tensor = {}
+    Tgn, Tnf = as_transitions(Tgn), as_transitions(Tnf)
+    t_gn, t_nf = dd_amplitudes(Tgn, Tnf, filterin, filterout)
+    nf_groups = group_by_n(Tnf)
 
-    for [w_gn, Xgn, Ygn, Zgn, in1, in2] in Tgn: # loop g states
+    for r, (in1, in2) in enumerate(zip(Tgn.i.tolist(), Tgn.j.tolist())): # loop g states
         
-        matching_nf = [row for row in Tnf if row[-1].real == in2.real] # match n states
+        matching_nf = nf_groups.get(in2, []) # match n states
         
-        for [w_nf, Xnf, Ynf, Znf, out1, out2] in matching_nf:
-            t_gn = filterin @ np.array([Xgn, Ygn, Zgn])
-            t_nf = filterout @ np.array([Xnf, Ynf, Znf]).conj()
-            t_gnf = R @ np.outer(t_gn, t_nf) @ R.T
+        for s in matching_nf:
+            t_gnf = R @ np.outer(t_gn[r], t_nf[s]) @ R.T
                         
-            tensor[(int(in1.real), int(in2.real), int(out1.real))] = (w_gn, w_nf, t_gnf)
+            tensor[(in1, in2, int(Tnf.i[s]))] = (Tgn.E[r], Tnf.E[s], t_gnf)
             
     return tensor
 
-def sc_dd_ang_intf(wi, tensor, Gamma_n, V):
+def sc_dd_ang_intf(wi, tensor, Gamma_n, V, table=None):
+    # table: the (g,f) -> DE_g,f table of tensor_delta(tensor); pass it to skip the energy check at every wi
     data = []
+    if table is None:
+        table = tensor_delta(tensor)[0]
     
     default = (0.0, 0.0, np.zeros((3,3), dtype=complex))
     max_g = max(g for (g, n, f) in tensor)
@@ -27,7 +35,6 @@ def sc_dd_ang_intf(wi, tensor, Gamma_n, V):
     for g in range(1, max_g+1):
         for f in range(1, max_f+1):
             SumT = np.zeros([3, 3], dtype=complex)
-            Delta = []
             
             for n in range(1, max_n+1):
                 try:
@@ -36,40 +43,91 @@ def sc_dd_ang_intf(wi, tensor, Gamma_n, V):
                     continue
                     
                 SumT = SumT + t_gnf / (wi - w_gn + Gamma_n * 1j)
-                Delta.append((w_gn - w_nf).real)
 
-            I = np.sum(np.abs(V * SumT)**2)
+            I = np.abs(np.sum(V * SumT))**2
             
-            if Delta:
-                if np.var(Delta) >= 1e-8:
-                    print(f"Error: Not Matched DE_g,f! State Index: g={g}, f={f}")
-                data.append([np.average(Delta), I.real])
+            if (g, f) in table:
+                data.append([table[(g, f)], I.real])
             
     return np.vstack(data)
 
-def sc_dd_conv(w_inc, w_los, Tgn, Tnf, R, Gamma_n=2, Gamma_f=2, theta=45, phii=0, phio=0, filterin=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1])):
-    I = np.zeros((len(w_los), len(w_inc))) 
-    
-    print("\rConverting Data...", end='', flush=True)
-
-    tensor = sc_dd_tensor(Tgn, Tnf, R, filterin, filterout)
-
+def sc_pol(theta, phii=0, phio=0):
     ei = np.array([np.sin(phii*np.pi/180), 0, np.cos(phii*np.pi/180)])
     eo = np.array([np.sin(phio*np.pi/180), -np.sin(2*theta*np.pi/180)*np.cos(phio*np.pi/180), -np.cos(2*theta*np.pi/180)*np.cos(phio*np.pi/180)])
     
-    V = np.outer(ei, eo)
+    return ei, eo
 
-    for i, wi in enumerate(w_inc):
-        inf_result = sc_dd_ang_intf(wi, tensor, Gamma_n, V)
+def sc_channels(theta, channels):
+    # ei[a], eo[b] of all channels and W[c, a, b] = 1 where channel c sums |ei_a.T.eo_b|^2
+    # phio=None adds both outgoing polarizations (phio = 0 and 90)
+    channels = pol_channels(channels)
+    ei, eo, pairs = [], [], []
+    
+    for c, (phii, phio) in enumerate(channels):
+        ei.append(sc_pol(theta, phii)[0])
+        for phi in ([0, 90] if phio is None else [phio]):
+            pairs.append((c, c, len(eo)))
+            eo.append(sc_pol(theta, 0, phi)[1])
             
-        Delta = inf_result[:, 0]
-        Intensity = inf_result[:, 1]
-        
-        for j, loss in enumerate(w_los): 
-            conv = Intensity * (Gamma_f / np.pi) / ((Delta - loss)**2 + Gamma_f**2)
-            I[j, i] = ((wi - loss) / wi) * np.sum(conv)
+    W = np.zeros((len(ei), len(ei), len(eo)))
+    W[tuple(np.transpose(pairs))] = 1
+    
+    return np.array(ei), np.array(eo), W
+
+def sc_dd_ang_gemm(wi, prep, Gamma_n, ui, uo, W):
+    # ui (..., A, 3), uo (..., B, 3) are the ei, eo in the crystal frame; the sum over n is shared by all of them
+    SumT = rixs_resonance(wi, prep, Gamma_n)
+    
+    I = np.abs(np.einsum('...ai,pij,...bj->...abp', ui, SumT, uo, optimize=True))**2
+    
+    # W[c, a, b] sums the (ei_a, eo_b) projections into channel c; a single geometry has W[a, b] or one of each
+    if W is None:
+        return I[..., 0, 0, :]
+    if W.ndim == 2:
+        return np.einsum('ab,...abp->...p', W, I)
+    
+    return np.einsum('cab,...abp->c...p', W, I)
+
+def sc_dd_plan(w_inc, Tgn, Tnf, R, Gamma_n=2, theta=45, phii=0, phio=0, filterin=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1]), channels=None, n_window=None, amp_tol=0, w_los=None, Gamma_f=2, los_tol=0, temperature=None, weights=None, pop_tol=1e-4, profile='lorentzian', Sigma=None):
+    # prepared amplitudes and the per-energy intensity function with its arguments
+    progress('prepare', "Converting Data...")
+
+    R = np.asarray(R, dtype=float)
+    ei, eo, W = sc_channels(theta, [(phii, phio)] if channels is None else channels)
+    # a single geometry keeps no channel axis: W[a, b], or None when it is one (ei, eo) pair
+    W = (None if W.shape[2] == 1 else W[0]) if channels is None else W
+    
+    # ei.(R T R^T).eo = (R^T ei).T.(R^T eo)
+    ui = np.einsum('...ji,aj->...ai', R, ei)
+    uo = np.einsum('...ji,bj->...bi', R, eo)
+
+    if R.ndim == 2:
+        t_gn, t_nf = dd_amplitudes(Tgn, Tnf, filterin, filterout)
+        prep = rixs_prepare(Tgn, Tnf, t_gn @ ui.T, t_nf @ uo.T)
+        func, args = rixs_coherent, (Gamma_n, W)
+    else:
+        prep = dd_prepare(Tgn, Tnf, filterin, filterout)
+        func, args = sc_dd_ang_gemm, (Gamma_n, ui, uo, W)
+
+    prep = rixs_prune(rixs_thermal(prep, temperature, weights, pop_tol), w_los, Gamma_f, los_tol, profile, Sigma)
+    prep = rixs_screen(prep, w_inc, Gamma_n, n_window, amp_tol)
+    
+    return prep, func, args
+
+def sc_dd_sticks(w_inc, Tgn, Tnf, R, Gamma_n=2, theta=45, phii=0, phio=0, filterin=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1]), workers=None, executor=None, channels=None, n_window=None, amp_tol=0, w_los=None, Gamma_f=2, los_tol=0, temperature=None, weights=None, pop_tol=1e-4, profile='lorentzian', Sigma=None):
+    # unbroadened (Delta, intensity) sticks per incident energy, S of shape (w_inc, [channels,] ..., pairs)
+    prep, func, args = sc_dd_plan(w_inc, Tgn, Tnf, R, Gamma_n, theta, phii, phio, filterin, filterout, channels, n_window, amp_tol, w_los, Gamma_f, los_tol, temperature, weights, pop_tol, profile, Sigma)
         
-        print(f"\rProcessing: {i / len(w_inc) * 100:.2f}% ", end='', flush=True)
-    print("\rFinished!          ", flush=True) 
+    return stick_map(func, w_inc, prep, args, workers, executor)
+
+def sc_dd_conv(w_inc, w_los, Tgn, Tnf, R, Gamma_n=2, Gamma_f=2, theta=45, phii=0, phio=0, filterin=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1]), FFT=False, workers=None, executor=None, channels=None, n_window=None, amp_tol=0, los_tol=0, max_memory=None, out=None, temperature=None, weights=None, pop_tol=1e-4):
+    prep, func, args = sc_dd_plan(w_inc, Tgn, Tnf, R, Gamma_n, theta, phii, phio, filterin, filterout, channels, n_window, amp_tol, w_los, Gamma_f, los_tol, temperature, weights, pop_tol)
+    I = rixs_map(func, w_inc, w_los, prep, args, Gamma_f, FFT, workers=workers, executor=executor, max_memory=max_memory, out=out)
+    progress('finished', "Finished!")
     
     return I
+
+def sc_dd_calc(w_inc, w_los, Tgn, Tnf, R, Gamma_n=2, Gamma_f=2, theta=45, phii=0, phio=0, filterin=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1]), FFT=False, workers=None, executor=None, channels=None, n_window=None, amp_tol=0, los_tol=0, temperature=None, weights=None, pop_tol=1e-4, profile='lorentzian', Sigma=None):
+    prep, func, args = sc_dd_plan(w_inc, Tgn, Tnf, R, Gamma_n, theta, phii, phio, filterin, filterout, channels, n_window, amp_tol, w_los, Gamma_f, los_tol, temperature, weights, pop_tol, profile, Sigma)
+
+    return RixsCalc(prep, func, args, Gamma_f, FFT, profile, Sigma, workers=workers, executor=executor, inc_window=None if n_window is None else w_inc, los_window=w_los if los_tol else None)
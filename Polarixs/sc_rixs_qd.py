@@ -1,23 +1,37 @@
 import numpy as np
+from .transitions import as_transitions
+from .calculation import RixsCalc
+from .progress import progress
+from .rixs_engine import group_by_n, tensor_delta, rixs_prepare, qd_amplitudes, qd_prepare, rixs_resonance, rixs_coherent, stick_map, rixs_map, rixs_thermal, rixs_prune, rixs_screen
+from .sc_rixs_dd import sc_channels
+
+# direction of the incident beam: ei of sc_pol lies in the xz plane and the scattered beam, along (0, cos 2theta, -sin 2theta), is 2theta away
+K_IN = np.array([0.0, 1.0, 0.0])
 
 def sc_qd_tensor(Tgn, Tnf, R, filterinl=np.diag([1, 1, 1]), filterinr=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1])):
     tensor = {}
+    Tgn, Tnf = as_transitions(Tgn), as_transitions(Tnf)
+    t_gn, t_nf = qd_amplitudes(Tgn, Tnf, filterinl, filterinr, filterout)
+    t_gn, t_nf = R @ t_gn @ R.T, t_nf @ R.T
+    nf_groups = group_by_n(Tnf)
 
-    for [w_gn, XXgn, XYgn, XZgn, YYgn, YZgn, ZZgn, in1, in2] in Tgn: # loop g states
+    for r, (in1, in2) in enumerate(zip(Tgn.i.tolist(), Tgn.j.tolist())): # loop g states
         
-        matching_nf = [row for row in Tnf if row[-1].real == in2.real] # match n states
+        matching_nf = nf_groups.get(in2, []) # match n states
         
-        for [w_nf, Xnf, Ynf, Znf, out1, out2] in matching_nf: 
-            t_gn = R @ filterinl @ np.array([[XXgn, XYgn, XZgn], [XYgn, YYgn, YZgn], [XZgn, YZgn, ZZgn]]) @ filterinr @ R.T
-            t_nf = R @ filterout @ np.array([Xnf, Ynf, Znf]).conj()
-            t_gnf = t_gn[:, :, None] * t_nf[None, None, :]
+        for s in matching_nf:
+            t_gnf = t_gn[r][:, :, None] * t_nf[s][None, None, :]
                         
-            tensor[(int(in1.real), int(in2.real), int(out1.real))] = (w_gn, w_nf, t_gnf)
+            tensor[(in1, in2, int(Tnf.i[s]))] = (Tgn.E[r], Tnf.E[s], t_gnf)
             
     return tensor
 
-def sc_qd_ang_intf(wi, tensor, Gamma_n, ei, eo, k):
+def sc_qd_ang_intf(wi, tensor, Gamma_n, ei, eo, k=K_IN, table=None):
+    # table: the (g,f) -> DE_g,f table of tensor_delta(tensor); pass it to skip the energy check at every wi
     data = []
+    V = ei[:, None, None] * k[None, :, None] * eo[None, None, :]
+    if table is None:
+        table = tensor_delta(tensor)[0]
     
     max_g = max(g for (g, n, f) in tensor)
     max_n = max(n for (g, n, f) in tensor)
@@ -26,7 +40,6 @@ def sc_qd_ang_intf(wi, tensor, Gamma_n, ei, eo, k):
     for g in range(1, max_g+1):
         for f in range(1, max_f+1):
             SumT = np.zeros([3, 3, 3], dtype=complex)
-            Delta = []
             
             for n in range(1, max_n+1):
                 try:
@@ -35,40 +48,70 @@ def sc_qd_ang_intf(wi, tensor, Gamma_n, ei, eo, k):
                     continue
                     
                 SumT = SumT + t_gnf / (wi - w_gn + Gamma_n * 1j)
-                Delta.append((w_gn - w_nf).real)
 
-            I = np.sum(np.abs(V * SumT)**2)
+            I = np.abs(np.sum(V * SumT))**2
                        
-            if Delta:
-                if np.var(Delta) >= 1e-8:
-                    print(f"Error: Not Matched DE_g,f! State Index: g={g}, f={f}")
-                data.append([np.average(Delta), I.real])
+            if (g, f) in table:
+                data.append([table[(g, f)], I.real])
             
     return np.vstack(data)
 
-def sc_qd_conv(w_inc, w_los, Tgn, Tnf, R, Gamma_n=2, Gamma_f=2, theta=45, phii=0, phio=0, filterinl=np.diag([1, 1, 1]), filterinr=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1])):
-    I = np.zeros((len(w_los), len(w_inc))) 
+def sc_qd_ang_gemm(wi, prep, Gamma_n, ui, uk, uo, W):
+    # ui (..., A, 3), uk (..., 3), uo (..., B, 3) are ei, k and eo in the crystal frame; the sum over n is shared by all of them
+    SumT = rixs_resonance(wi, prep, Gamma_n).reshape(-1, 3, 3, 3)
+    
+    I = np.abs(np.einsum('...ai,pijk,...j,...bk->...abp', ui, SumT, uk, uo, optimize=True))**2
+    
+    # W[c, a, b] sums the (ei_a, eo_b) projections into channel c; a single geometry has W[a, b] or one of each
+    if W is None:
+        return I[..., 0, 0, :]
+    if W.ndim == 2:
+        return np.einsum('ab,...abp->...p', W, I)
     
-    print("\rConverting Data...", end='', flush=True)
-    tensor = sc_qd_tensor(Tgn, Tnf, R, filterinl, filterinr, filterout)
+    return np.einsum('cab,...abp->c...p', W, I)
 
-    ei = np.array([np.sin(phii*np.pi/180), 0, np.cos(phii*np.pi/180)])
-    eo = np.array([np.sin(phio*np.pi/180), -np.sin(2*theta*np.pi/180)*np.cos(phio*np.pi/180), -np.cos(2*theta*np.pi/180)*np.cos(phio*np.pi/180)])
-    k = np.array([0, -np.cos(2*theta*np.pi/180), np.sin(2*theta*np.pi/180)])
+def sc_qd_plan(w_inc, Tgn, Tnf, R, Gamma_n=2, theta=45, phii=0, phio=0, filterinl=np.diag([1, 1, 1]), filterinr=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1]), channels=None, n_window=None, amp_tol=0, w_los=None, Gamma_f=2, los_tol=0, temperature=None, weights=None, pop_tol=1e-4, profile='lorentzian', Sigma=None):
+    # prepared amplitudes and the per-energy intensity function with its arguments
+    progress('prepare', "Converting Data...")
+
+    R = np.asarray(R, dtype=float)
+    ei, eo, W = sc_channels(theta, [(phii, phio)] if channels is None else channels)
+    # a single geometry keeps no channel axis: W[a, b], or None when it is one (ei, eo) pair
+    W = (None if W.shape[2] == 1 else W[0]) if channels is None else W
     
-    V = ei[:, None, None] * eo[None, :, None] * ei[None, None, :]
+    # the E2 absorption vertex (ei . r)(k . r) projects the quadrupole g->n amplitude on ei and the incident
+    # direction k, the n->f dipole is projected on eo
+    ui = np.einsum('...ji,aj->...ai', R, ei)
+    uk = np.einsum('...ji,j->...i', R, K_IN)
+    uo = np.einsum('...ji,bj->...bi', R, eo)
 
-    for i, wi in enumerate(w_inc):
-        inf_result = sc_qd_ang_intf(wi, tensor, Gamma_n, V)
-            
-        Delta = inf_result[:, 0]
-        Intensity = inf_result[:, 1]
-        
-        for j, loss in enumerate(w_los): 
-            conv = Intensity * (Gamma_f / np.pi) / ((Delta - loss)**2 + Gamma_f**2)
-            I[j, i] = ((wi - loss) / wi) * np.sum(conv)
+    if R.ndim == 2:
+        t_gn, t_nf = qd_amplitudes(Tgn, Tnf, filterinl, filterinr, filterout)
+        prep = rixs_prepare(Tgn, Tnf, np.einsum('ai,rij,j->ra', ui, t_gn, uk), t_nf @ uo.T)
+        func, args = rixs_coherent, (Gamma_n, W)
+    else:
+        prep = qd_prepare(Tgn, Tnf, filterinl, filterinr, filterout)
+        func, args = sc_qd_ang_gemm, (Gamma_n, ui, uk, uo, W)
+
+    prep = rixs_prune(rixs_thermal(prep, temperature, weights, pop_tol), w_los, Gamma_f, los_tol, profile, Sigma)
+    prep = rixs_screen(prep, w_inc, Gamma_n, n_window, amp_tol)
+    
+    return prep, func, args
+
+def sc_qd_sticks(w_inc, Tgn, Tnf, R, Gamma_n=2, theta=45, phii=0, phio=0, filterinl=np.diag([1, 1, 1]), filterinr=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1]), workers=None, executor=None, channels=None, n_window=None, amp_tol=0, w_los=None, Gamma_f=2, los_tol=0, temperature=None, weights=None, pop_tol=1e-4, profile='lorentzian', Sigma=None):
+    # unbroadened (Delta, intensity) sticks per incident energy, S of shape (w_inc, [channels,] ..., pairs)
+    prep, func, args = sc_qd_plan(w_inc, Tgn, Tnf, R, Gamma_n, theta, phii, phio, filterinl, filterinr, filterout, channels, n_window, amp_tol, w_los, Gamma_f, los_tol, temperature, weights, pop_tol, profile, Sigma)
         
-        print(f"\rProcessing: {i / len(w_inc) * 100:.2f}% ", end='', flush=True)
-    print("\rFinished!          ", flush=True) 
+    return stick_map(func, w_inc, prep, args, workers, executor)
+
+def sc_qd_conv(w_inc, w_los, Tgn, Tnf, R, Gamma_n=2, Gamma_f=2, theta=45, phii=0, phio=0, filterinl=np.diag([1, 1, 1]), filterinr=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1]), FFT=False, workers=None, executor=None, channels=None, n_window=None, amp_tol=0, los_tol=0, max_memory=None, out=None, temperature=None, weights=None, pop_tol=1e-4):
+    prep, func, args = sc_qd_plan(w_inc, Tgn, Tnf, R, Gamma_n, theta, phii, phio, filterinl, filterinr, filterout, channels, n_window, amp_tol, w_los, Gamma_f, los_tol, temperature, weights, pop_tol)
+    I = rixs_map(func, w_inc, w_los, prep, args, Gamma_f, FFT, workers=workers, executor=executor, max_memory=max_memory, out=out)
+    progress('finished', "Finished!")
     
     return I
+
+def sc_qd_calc(w_inc, w_los, Tgn, Tnf, R, Gamma_n=2, Gamma_f=2, theta=45, phii=0, phio=0, filterinl=np.diag([1, 1, 1]), filterinr=np.diag([1, 1, 1]), filterout=np.diag([1, 1, 1]), FFT=False, workers=None, executor=None, channels=None, n_window=None, amp_tol=0, los_tol=0, temperature=None, weights=None, pop_tol=1e-4, profile='lorentzian', Sigma=None):
+    prep, func, args = sc_qd_plan(w_inc, Tgn, Tnf, R, Gamma_n, theta, phii, phio, filterinl, filterinr, filterout, channels, n_window, amp_tol, w_los, Gamma_f, los_tol, temperature, weights, pop_tol, profile, Sigma)
+
+    return RixsCalc(prep, func, args, Gamma_f, FFT, profile, Sigma, workers=workers, executor=executor, inc_window=None if n_window is None else w_inc, los_window=w_los if los_tol else None)
@@ -1,28 +1,72 @@
 import numpy as np
+from .broadening import line_shape, gamma_at
+from .transitions import TransitionSet, as_transitions
+from .calculation import RixsCalc
+from .progress import progress, timed, count
+from .rixs_engine import group_by_n, tensor_delta, int_prepare, rixs_incoherent, stick_map, rixs_map, linked_energies, ground_population, rixs_thermal, rixs_prune, rixs_screen
 
-def xas_conv(w_inc, T, Gamma=2):
-    I = np.zeros_like(w_inc)
+def xas_thermal(T, temperature=None, weights=None, pop_tol=1e-4):
+    # rows of the g states above pop_tol of the total population, with the intensities scaled by that population
+    T = as_transitions(T)
+    if temperature is None and weights is None:
+        return T
     
-    for trans in T:
-        I += trans[1] * Gamma / (np.pi * ((w_inc - trans[0])**2 + Gamma**2))
+    g, gi = np.unique(T.i, return_inverse=True)
+    n, ni = np.unique(T.j, return_inverse=True)
+    Wgn = np.zeros((len(g), len(n)))
+    linked = np.zeros((len(g), len(n)), dtype=bool)
+    Wgn[gi, ni] = T.E
+    linked[gi, ni] = True
     
-    return I
+    pop = ground_population(g, lambda: linked_energies(g, Wgn, linked), temperature, weights)
+    keep_g = pop > pop_tol * np.sum(pop)
+    keep = keep_g[gi]
+    
+    count('g_states_kept', np.sum(keep_g))
+    progress('weighting', f"Weighting: kept {np.sum(keep_g)} of {len(g)} ground states with population above {pop_tol:g}")
+    
+    return TransitionSet(T.E[keep], T.M[keep] * pop[gi[keep]][:, None], T.i[keep], T.j[keep])
+
+@timed('broadening')
+def xas_conv(w_inc, T, Gamma=2, profile='lorentzian', Sigma=None, max_memory=None, temperature=None, weights=None, pop_tol=1e-4):
+    # Gamma: a width, a function of the transition energy (e.g. arctan_gamma) or a list of these for a batch of spectra
+    w_inc = np.asarray(w_inc, dtype=float)
+    T = xas_thermal(T, temperature, weights, pop_tol)
+    E, A = T.E, T.M[:, 0].real
+    
+    batch = isinstance(Gamma, (list, tuple)) or np.ndim(Gamma) > 0
+    Gammas = Gamma if batch else [Gamma]
+    I = np.zeros((len(Gammas), len(w_inc)))
+    
+    # transitions are evaluated against the grid in blocks whose temporaries stay under max_memory (256 MB by default)
+    step = max(1, int((max_memory or 1 << 28) // (32 * max(len(w_inc), 1))))
+    for k, G in enumerate(Gammas):
+        width = np.broadcast_to(gamma_at(G, E), E.shape)
+        for c in range(0, len(E), step):
+            I[k] += line_shape(w_inc[:, None] - E[None, c:c+step], width[None, c:c+step], profile, Sigma) @ A[c:c+step]
+    
+    return I if batch else I[0]
 
 def rixs_trans(Tgn, Tnf):
     intensity = {}
+    Tgn, Tnf = as_transitions(Tgn), as_transitions(Tnf)
+    nf_groups = group_by_n(Tnf)
 
-    for [w_gn, int_gn, in1, in2] in Tgn: # loop g states
+    for r, (in1, in2) in enumerate(zip(Tgn.i.tolist(), Tgn.j.tolist())): # loop g states
         
-        matching_nf = [row for row in Tnf if row[-1] == in2] # match n states 
+        matching_nf = nf_groups.get(in2, []) # match n states
         
-        for [w_nf, int_nf, out1, out2] in matching_nf:   
-            I = np.abs(int_gn * int_nf)
-            intensity[(int(in1), int(in2), int(out1))] = (w_gn, w_nf, I)
+        for s in matching_nf:   
+            I = np.abs(Tgn.M[r, 0] * Tnf.M[s, 0])
+            intensity[(in1, in2, int(Tnf.i[s]))] = (Tgn.E[r], Tnf.E[s], I)
             
     return intensity
 
-def rixs_intf(wi, tensor, Gamma_n):
+def rixs_intf(wi, tensor, Gamma_n, table=None):
+    # table: the (g,f) -> DE_g,f table of tensor_delta(tensor); pass it to skip the energy check at every wi
     data = []
+    if table is None:
+        table = tensor_delta(tensor)[0]
     
     default = (0.0, 0.0, np.zeros((3,3), dtype=complex))
     max_g = max(g for (g, n, f) in tensor)
@@ -32,7 +76,6 @@ def rixs_intf(wi, tensor, Gamma_n):
     for g in range(1, max_g+1):
         for f in range(1, max_f+1):
             I = 0
-            Delta = []
             
             for n in range(1, max_n+1):
                 try:
@@ -41,33 +84,37 @@ def rixs_intf(wi, tensor, Gamma_n):
                     continue
                     
                 I = I + t_gnf / ((wi - w_gn)**2 + Gamma_n**2)
-                Delta.append((w_gn - w_nf))
             
-            if Delta:
-                if np.var(Delta) >= 1e-10:
-                    print(f"Error: Not Matched DE_g,f! State Index: g={g}, f={f}")
-                data.append([np.average(Delta), I])
+            if (g, f) in table:
+                data.append([table[(g, f)], I])
             
     return np.vstack(data)
 
-def rixs_conv(w_inc, w_los, Tgn, Tnf, Gamma_n=2, Gamma_f=2):
-    I = np.zeros((len(w_los), len(w_inc))) 
+def rixs_gemm(wi, prep, Gamma_n):
+    return rixs_incoherent(wi, prep, Gamma_n)
 
-    print("\rConverting Data...", end='', flush=True)
+def rixs_plan(w_inc, Tgn, Tnf, Gamma_n=2, n_window=None, amp_tol=0, w_los=None, Gamma_f=2, los_tol=0, temperature=None, weights=None, pop_tol=1e-4, profile='lorentzian', Sigma=None):
+    progress('prepare', "Converting Data...")
+    
+    prep = rixs_prune(rixs_thermal(int_prepare(Tgn, Tnf), temperature, weights, pop_tol), w_los, Gamma_f, los_tol, profile, Sigma)
+    prep = rixs_screen(prep, w_inc, Gamma_n, n_window, amp_tol)
     
-    trans = rixs_trans(Tgn, Tnf)
+    return prep, rixs_gemm, (Gamma_n,)
 
-    for i, wi in enumerate(w_inc):
-        inf_result = rixs_intf(wi, trans, Gamma_n)
-            
-        Delta = inf_result[:, 0]
-        Intensity = inf_result[:, 1]
-        
-        for j, loss in enumerate(w_los): 
-            conv = Intensity * (Gamma_f / np.pi) / ((Delta - loss)**2 + Gamma_f**2)
-            I[j, i] = ((wi - loss) / wi) * np.sum(conv)
-        
-        print(f"\rProcessing: {i / len(w_inc) * 100:.2f}% ", end='', flush=True)
-    print("\rFinished!          ", flush=True) 
+def rixs_sticks(w_inc, Tgn, Tnf, Gamma_n=2, workers=None, executor=None, n_window=None, amp_tol=0, w_los=None, Gamma_f=2, los_tol=0, temperature=None, weights=None, pop_tol=1e-4, profile='lorentzian', Sigma=None):
+    # unbroadened (Delta, intensity) sticks per incident energy; w_los, Gamma_f, los_tol, profile and Sigma are only used for pruning
+    prep, func, args = rixs_plan(w_inc, Tgn, Tnf, Gamma_n, n_window, amp_tol, w_los, Gamma_f, los_tol, temperature, weights, pop_tol, profile, Sigma)
+    
+    return stick_map(func, w_inc, prep, args, workers, executor)
+
+def rixs_conv(w_inc, w_los, Tgn, Tnf, Gamma_n=2, Gamma_f=2, FFT=False, workers=None, executor=None, n_window=None, amp_tol=0, los_tol=0, profile='lorentzian', Sigma=None, max_memory=None, out=None, temperature=None, weights=None, pop_tol=1e-4):
+    prep, func, args = rixs_plan(w_inc, Tgn, Tnf, Gamma_n, n_window, amp_tol, w_los, Gamma_f, los_tol, temperature, weights, pop_tol, profile, Sigma)
+    I = rixs_map(func, w_inc, w_los, prep, args, Gamma_f, FFT, profile, Sigma, workers, executor, max_memory, out)
+    progress('finished', "Finished!")
     
     return I
+
+def rixs_calc(w_inc, w_los, Tgn, Tnf, Gamma_n=2, Gamma_f=2, FFT=False, workers=None, executor=None, n_window=None, amp_tol=0, los_tol=0, profile='lorentzian', Sigma=None, temperature=None, weights=None, pop_tol=1e-4):
+    prep, func, args = rixs_plan(w_inc, Tgn, Tnf, Gamma_n, n_window, amp_tol, w_los, Gamma_f, los_tol, temperature, weights, pop_tol, profile, Sigma)
+
+    return RixsCalc(prep, func, args, Gamma_f, FFT, profile, Sigma, workers=workers, executor=executor, inc_window=None if n_window is None else w_inc, los_window=w_los if los_tol else None)
@@ -0,0 +1,81 @@
+import numpy as np
+
+#####################
+#                   #
+#  Transition Sets  #
+#                   #
+#####################
+class TransitionSet:
+    # transitions |i> -> |j> with energy E and components M (intensity, vector or tensor) as separate typed arrays;
+    # indexing a row gives the packed [Delta E, components..., |i> index, |j> index] list row
+    __slots__ = ('E', 'M', 'i', 'j')
+
+    def __init__(self, E, M, i, j):
+        self.E = np.asarray(E, dtype=np.float64)
+        self.M = np.asarray(M)
+        if self.M.ndim == 1:
+            self.M = self.M[:, None]
+        self.i = np.asarray(i, dtype=np.int32)
+        self.j = np.asarray(j, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.E)
+
+    @property
+    def shape(self):
+        # shape of the packed rows
+        return (len(self), self.M.shape[1] + 3)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.packed(slice(key, key + 1 or None))[0]
+        if isinstance(key, tuple):
+            return self.packed()[key]
+        # slices give views on the same arrays
+        return TransitionSet(self.E[key], self.M[key], self.i[key], self.j[key])
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self.packed()
+
+        return data if dtype is None else data.astype(dtype)
+
+    def __getstate__(self):
+        return (self.E, self.M, self.i, self.j)
+
+    def __setstate__(self, state):
+        self.E, self.M, self.i, self.j = state
+
+    def __repr__(self):
+        return f"TransitionSet({len(self)} transitions, {self.M.shape[1]} {self.M.dtype} components)"
+
+    def packed(self, rows=slice(None)):
+        # the legacy row layout, complex when the components are
+        M = self.M[rows]
+        data = np.empty((len(M), M.shape[1] + 3), dtype=np.result_type(M.dtype, np.float64))
+        data[:, 0] = self.E[rows]
+        data[:, 1:-2] = M
+        data[:, -2] = self.i[rows]
+        data[:, -1] = self.j[rows]
+
+        return data
+
+    def select(self, GStates=None, Subset=0):
+        # transitions from the states in GStates, with Subset subtracted from the |j> index
+        T = self[np.isin(self.i, GStates)] if GStates else self
+
+        return TransitionSet(T.E, T.M, T.i, T.j - Subset) if Subset else T
+
+def as_transitions(T):
+    # a TransitionSet, or a list/array of [Delta E, components..., |i> index, |j> index] rows
+    if isinstance(T, TransitionSet):
+        return T
+
+    T = np.asarray(T)
+    if T.ndim != 2:
+        T = T.reshape(len(T), -1) if T.size else np.zeros((0, 3))
+
+    return TransitionSet(T[:, 0].real, T[:, 1:-2], T[:, -2].real.astype(np.int32), T[:, -1].real.astype(np.int32))
@@ -0,0 +1,60 @@
+import numpy as np
+import baseline as base
+
+#########################
+#                       #
+#  Reference Solutions  #
+#                       #
+#########################
+# the original per-energy loop of baseline.py: (g,n,f) dictionary tensor, one intf call per incident energy
+# and the Lorentzian loss sum written out point by point
+
+def reference_conv(w_inc, w_los, intf, Gamma_f):
+    I = np.zeros((len(w_los), len(w_inc)))
+
+    for i, wi in enumerate(w_inc):
+        data = intf(wi)
+        Delta, S = data[:, 0], data[:, 1]
+        for j, loss in enumerate(w_los):
+            I[j, i] = ((wi - loss) / wi) * np.sum(S * (Gamma_f / np.pi) / ((Delta - loss)**2 + Gamma_f**2))
+
+    return I
+
+def rixs_reference(w_inc, w_los, Tgn, Tnf, Gamma_n=2, Gamma_f=2):
+    tensor = base.rixs_trans(Tgn, Tnf)
+
+    return reference_conv(w_inc, w_los, lambda wi: base.rixs_intf(wi, tensor, Gamma_n), Gamma_f)
+
+def pw_dd_reference(w_inc, w_los, Tgn, Tnf, Gamma_n=2, Gamma_f=2, AngDep=True, theta=45, phii=0, phio=None):
+    tensor = base.pw_dd_tensor(Tgn, Tnf)
+    if AngDep:
+        intf = lambda wi: base.pw_dd_ang_intf(wi, tensor, Gamma_n, theta, phii, phio)
+    else:
+        intf = lambda wi: base.pw_dd_approx(wi, tensor, Gamma_n)
+
+    return reference_conv(w_inc, w_los, intf, Gamma_f)
+
+def pw_qd_reference(w_inc, w_los, Tgn, Tnf, Gamma_n=2, Gamma_f=2, AngDep=True, theta=45, phii=0, phio=None):
+    tensor = base.pw_qd_tensor(Tgn, Tnf)
+    if AngDep:
+        intf = lambda wi: base.pw_qd_ang_intf(wi, tensor, Gamma_n, theta, phii, phio)
+    else:
+        intf = lambda wi: base.pw_qd_approx(wi, tensor, Gamma_n)
+
+    return reference_conv(w_inc, w_los, intf, Gamma_f)
+
+def sc_dd_reference(w_inc, w_los, Tgn, Tnf, R, Gamma_n=2, Gamma_f=2, theta=45, phii=0, phio=0):
+    tensor = base.sc_dd_tensor(Tgn, Tnf, R)
+    ei, eo = base.sc_vectors(theta, phii, phio)
+    V = np.outer(ei, eo)
+
+    return reference_conv(w_inc, w_los, lambda wi: base.sc_dd_ang_intf(wi, tensor, Gamma_n, V), Gamma_f)
+
+def sc_qd_reference(w_inc, w_los, Tgn, Tnf, R, Gamma_n=2, Gamma_f=2, theta=45, phii=0, phio=0):
+    tensor = base.sc_qd_tensor(Tgn, Tnf, R)
+    ei, eo = base.sc_vectors(theta, phii, phio)
+
+    return reference_conv(w_inc, w_los, lambda wi: base.sc_qd_ang_intf(wi, tensor, Gamma_n, ei, eo, base.K_IN), Gamma_f)
+
+def xas_reference(w_inc, T, Gamma=2):
+    return base.xas_conv(w_inc, T, Gamma)
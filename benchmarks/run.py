@@ -0,0 +1,273 @@
+import os
+import sys
+import gzip
+import lzma
+import json
+import shutil
+import time
+import tempfile
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Polarixs as P
+from Polarixs.progress import profiling
+from synthetic import transition_tables, matching_nf, write_rassi_out
+import reference as ref
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EXAMPLES = os.path.join(os.path.dirname(HERE), 'ExampleData')
+
+# a fixed crystal orientation for the sc_* engines
+R = np.array([[0.8660254, -0.5, 0], [0.5, 0.8660254, 0], [0, 0, 1]]) @ np.array([[1, 0, 0], [0, 0.9396926, -0.3420201], [0, 0.3420201, 0.9396926]])
+
+#############
+#           #
+#  Engines  #
+#           #
+#############
+# name: (layout of the synthetic tables, fast engine, reference solution), both called as f(w_inc, w_los, Tgn, Tnf)
+ENGINES = {
+    'rixs_conv': ('int', lambda x, y, gn, nf, **k: P.rixs_conv(x, y, gn, nf, 1.5, 1.5, **k),
+                  lambda x, y, gn, nf: ref.rixs_reference(x, y, gn, nf, 1.5, 1.5)),
+    'pw_dd_conv': ('vec', lambda x, y, gn, nf, **k: P.pw_dd_conv(x, y, gn, nf, 1.5, 1.5, theta=30, phii=20, phio=40, **k),
+                   lambda x, y, gn, nf: ref.pw_dd_reference(x, y, gn, nf, 1.5, 1.5, theta=30, phii=20, phio=40)),
+    'pw_dd_approx': ('vec', lambda x, y, gn, nf, **k: P.pw_dd_conv(x, y, gn, nf, 1.5, 1.5, AngDep=False, **k),
+                     lambda x, y, gn, nf: ref.pw_dd_reference(x, y, gn, nf, 1.5, 1.5, AngDep=False)),
+    'pw_qd_conv': ('ten', lambda x, y, gn, nf, **k: P.pw_qd_conv(x, y, gn, nf, 1.5, 1.5, theta=30, phii=20, phio=40, **k),
+                   lambda x, y, gn, nf: ref.pw_qd_reference(x, y, gn, nf, 1.5, 1.5, theta=30, phii=20, phio=40)),
+    'pw_qd_approx': ('ten', lambda x, y, gn, nf, **k: P.pw_qd_conv(x, y, gn, nf, 1.5, 1.5, AngDep=False, **k),
+                     lambda x, y, gn, nf: ref.pw_qd_reference(x, y, gn, nf, 1.5, 1.5, AngDep=False)),
+    'sc_dd_conv': ('vec', lambda x, y, gn, nf, **k: P.sc_dd_conv(x, y, gn, nf, R, 1.5, 1.5, theta=30, phii=20, phio=40, **k),
+                   lambda x, y, gn, nf: ref.sc_dd_reference(x, y, gn, nf, R, 1.5, 1.5, theta=30, phii=20, phio=40)),
+    'sc_qd_conv': ('ten', lambda x, y, gn, nf, **k: P.sc_qd_conv(x, y, gn, nf, R, 1.5, 1.5, theta=30, phii=20, phio=40, **k),
+                   lambda x, y, gn, nf: ref.sc_qd_reference(x, y, gn, nf, R, 1.5, 1.5, theta=30, phii=20, phio=40)),
+}
+
+# the same map through the other code paths: tiled under a small memory budget, and spread over threads
+VARIANTS = {
+    'tiled': {'max_memory': 1 << 16},
+    'workers': {'workers': 2},
+}
+
+# (G, N, F) of the engine sweep
+SIZES = {
+    'quick': [(1, 20, 10), (2, 60, 30)],
+    'default': [(1, 50, 20), (2, 150, 60), (4, 400, 150)],
+    'large': [(2, 150, 60), (4, 400, 150), (8, 1000, 400)],
+}
+
+# number of states of the synthetic RASSI outputs
+STATES = {
+    'quick': [40, 80],
+    'default': [50, 100, 200],
+    'large': [100, 200, 400],
+}
+
+#############
+#           #
+#  Helpers  #
+#           #
+#############
+def best_of(func, repeat):
+    # the fastest of repeat runs, and the profile of the last one
+    times = []
+    for _ in range(repeat):
+        with profiling() as stats:
+            start = time.perf_counter()
+            result = func()
+            times.append(time.perf_counter() - start)
+
+    return min(times), result, stats.as_dict()
+
+def rel_error(a, b):
+    return float(np.max(np.abs(np.asarray(a) - np.asarray(b))) / max(np.max(np.abs(b)), 1e-300))
+
+def grids(nx=41, ny=101):
+    return np.linspace(5880, 5920, nx), np.linspace(0, 20, ny)
+
+def report(results, name, **entry):
+    results.append({'name': name, **entry})
+    line = f"{name:<44}"
+    if 'time' in entry:
+        line += f" {entry['time']:9.4f} s"
+    if 'error' in entry:
+        line += f"   rel. error {entry['error']:.1e}" + ("" if entry['ok'] else "  FAILED")
+    print(line, flush=True)
+
+#############
+#           #
+#  Readers  #
+#           #
+#############
+def bench_readers(results, states, repeat, folder):
+    for soc in (True, False):
+        for nstates in states:
+            path = write_rassi_out(os.path.join(folder, f"rassi_{'so' if soc else 'sf'}_{nstates}.out"), nstates, soc=soc, seed=nstates)
+            size = os.path.getsize(path)
+            half = nstates // 2
+            readers = {
+                'Molcas_scan': lambda: P.Molcas_scan(path),
+                'Molcas_read_int': lambda: P.Molcas_read_int(path, SOC=soc, Subset=half, GStates=[1, 2]),
+                'Molcas_read_int quadrupole': lambda: P.Molcas_read_int(path, SOC=soc, Quadrupole=True, Subset=half, GStates=[1, 2]),
+                'Molcas_read_vec': lambda: P.Molcas_read_vec(path, SOC=soc, Subset=half, GStates=[1, 2]),
+                'Molcas_read_ten': lambda: P.Molcas_read_ten(path, SOC=soc, Mltpl=2, Subset=half, GStates=[1, 2]),
+            }
+            with open(path, 'rb') as f, gzip.open(path + '.gz', 'wb', compresslevel=1) as g:
+                shutil.copyfileobj(f, g)
+            readers['Molcas_read_ten .gz'] = lambda: P.Molcas_read_ten(path + '.gz', SOC=soc, Mltpl=2, Subset=half, GStates=[1, 2])
+            for name, func in readers.items():
+                t, _, stats = best_of(func, repeat)
+                report(results, f"{name} ({'SO' if soc else 'SF'}, {nstates} states)", group='readers', time=t, bytes=size, stats=stats)
+
+def check_compressed(results, folder):
+    # .gz and .xz outputs scan to the same arrays as the plain file
+    path = write_rassi_out(os.path.join(folder, 'rassi_zip.out'), 40, soc=True, seed=2)
+    plain = P.Molcas_scan(path)
+    for ext, opener in (('.gz', gzip.open), ('.xz', lzma.open)):
+        with open(path, 'rb') as f, opener(path + ext, 'wb') as g:
+            shutil.copyfileobj(f, g)
+        scan = P.Molcas_scan(path + ext)
+        ok = all(np.array_equal(scan[k][c], plain[k][c]) for k in plain if isinstance(plain[k], dict) for c in plain[k]) and \
+             all(np.array_equal(scan[k], plain[k]) for k in plain if not isinstance(plain[k], dict))
+        report(results, f"Molcas_scan {ext}", group='validation', error=0.0 if ok else 1.0, ok=ok)
+
+def check_cache(results, folder):
+    # a cached read gives back exactly what the parser returned
+    path = write_rassi_out(os.path.join(folder, 'rassi_cache.out'), 40, soc=True, seed=1)
+    cache = os.path.join(folder, 'cache')
+    for name, func in (('int', P.Molcas_read_int), ('vec', P.Molcas_read_vec), ('ten', P.Molcas_read_ten)):
+        T = func(path, SOC=True, Subset=20)
+        func(path, SOC=True, Subset=20, cache=cache)
+        C = func(path, SOC=True, Subset=20, cache=cache)
+        ok = all(np.array_equal(getattr(T, k), getattr(C, k)) for k in ('E', 'M', 'i', 'j'))
+        report(results, f"cache Molcas_read_{name}", group='validation', error=0.0 if ok else 1.0, ok=ok)
+
+###################
+#                 #
+#  Engine Sweeps  #
+#                 #
+###################
+def bench_engines(results, sizes, repeat):
+    x, y = grids()
+    for G, N, F in sizes:
+        for name, (layout, fast, _) in ENGINES.items():
+            gn, nf = transition_tables(G, N, F, layout, seed=N)
+            t, _, stats = best_of(lambda: fast(x, y, gn, nf), repeat)
+            report(results, f"{name} (G={G}, N={N}, F={F})", group='engines', time=t, size=[G, N, F], transitions=[len(gn), len(nf)], stats=stats)
+
+        gn, _ = transition_tables(G, N, F, 'int', seed=N)
+        t, _, stats = best_of(lambda: P.xas_conv(x, gn, 1.5), repeat)
+        report(results, f"xas_conv (G={G}, N={N})", group='engines', time=t, size=[G, N, F], transitions=[len(gn)], stats=stats)
+
+def check_engines(results, tol, size=(2, 12, 8)):
+    # every engine and code path against the per-energy reference loop at a size the loop handles quickly
+    x, y = grids(15, 31)
+    for name, (layout, fast, slow) in ENGINES.items():
+        gn, nf = transition_tables(*size, layout, seed=7)
+        t, expected, _ = best_of(lambda: slow(x, y, gn, nf), 1)
+        for variant, options in {'': {}, **VARIANTS}.items():
+            error = rel_error(fast(x, y, gn, nf, **options), expected)
+            report(results, f"{name} {variant}".strip(), group='validation', error=error, ok=error <= tol, reference_time=t)
+
+    gn, _ = transition_tables(*size, 'int', seed=7)
+    for variant, options in {'': {}, 'tiled': {'max_memory': 1 << 10}}.items():
+        error = rel_error(P.xas_conv(x, gn, 1.5, **options), ref.xas_reference(x, gn, 1.5))
+        report(results, f"xas_conv {variant}".strip(), group='validation', error=error, ok=error <= tol)
+
+def check_unpolarized(results, tol, size=(2, 12, 8)):
+    # phio=None (no polarization analysis) is the sum of the phio=0 and phio=90 maps, for one R and for a stack
+    x, y = grids(15, 31)
+    stack = np.stack([R, R.T])
+    for name, layout, conv in (('sc_dd_conv', 'vec', P.sc_dd_conv), ('sc_qd_conv', 'ten', P.sc_qd_conv)):
+        gn, nf = transition_tables(*size, layout, seed=7)
+        for label, rot in (('', R), (' stacked R', stack)):
+            maps = [conv(x, y, gn, nf, rot, 1.5, 1.5, theta=30, phii=20, phio=phio) for phio in (None, 0, 90)]
+            error = rel_error(maps[0], maps[1] + maps[2])
+            report(results, f"{name} phio=None{label}", group='validation', error=error, ok=error <= tol)
+
+##################
+#                #
+#  Example Data  #
+#                #
+##################
+def bench_examples(results, repeat, tol):
+    if not os.path.isdir(EXAMPLES):
+        return
+    path = lambda name: os.path.join(EXAMPLES, name)
+
+    readers = {
+        'XAS_Dipole.out int': lambda: P.Molcas_read_int(path('XAS_Dipole.out'), SOC=True),
+        'XAS_Quadrupole.out int': lambda: P.Molcas_read_int(path('XAS_Quadrupole.out'), SOC=True, Quadrupole=True),
+        'RIXS_DD_gn_int.out int': lambda: P.Molcas_read_int(path('RIXS_DD_gn_int.out'), SOC=True, Subset=27, GStates=[1]),
+        'RIXS_DD_gn_vec.out vec': lambda: P.Molcas_read_vec(path('RIXS_DD_gn_vec.out'), SOC=True, Subset=27, GStates=[1]),
+        'RIXS_QD_gn_int.out int': lambda: P.Molcas_read_int(path('RIXS_QD_gn_int.out'), SOC=True, Quadrupole=True, Subset=27, GStates=[1]),
+    }
+    data = {}
+    for name, func in readers.items():
+        t, data[name], stats = best_of(func, repeat)
+        report(results, f"read {name}", group='examples', time=t, transitions=len(data[name]), stats=stats)
+
+    T = data['XAS_Dipole.out int']
+    x = np.linspace(T.E.min() - 10, T.E.max() + 10, 400)
+    t, I, stats = best_of(lambda: P.xas_conv(x, T, 0.5), repeat)
+    report(results, "xas_conv XAS_Dipole.out", group='examples', time=t, stats=stats)
+    error = rel_error(I, ref.xas_reference(x, T, 0.5))
+    report(results, "xas_conv XAS_Dipole.out", group='validation', error=error, ok=error <= tol)
+
+    # the shipped files have no n->f half; it is generated on their intermediate states
+    gn = data['RIXS_DD_gn_vec.out vec']
+    nf = matching_nf(gn, 30, 'vec', seed=3)
+    x, y = np.linspace(gn.E.min() - 5, gn.E.max() + 5, 41), np.linspace(0, 20, 101)
+    for name in ('pw_dd_conv', 'sc_dd_conv'):
+        t, I, stats = best_of(lambda: ENGINES[name][1](x, y, gn, nf), repeat)
+        report(results, f"{name} RIXS_DD_gn_vec.out", group='examples', time=t, transitions=[len(gn), len(nf)], stats=stats)
+        error = rel_error(I, ENGINES[name][2](x, y, gn, nf))
+        report(results, f"{name} RIXS_DD_gn_vec.out", group='validation', error=error, ok=error <= tol)
+
+    gn = data['RIXS_DD_gn_int.out int']
+    nf = matching_nf(gn, 30, 'int', seed=3)
+    t, I, stats = best_of(lambda: ENGINES['rixs_conv'][1](x, y, gn, nf), repeat)
+    report(results, "rixs_conv RIXS_DD_gn_int.out", group='examples', time=t, transitions=[len(gn), len(nf)], stats=stats)
+    error = rel_error(I, ENGINES['rixs_conv'][2](x, y, gn, nf))
+    report(results, "rixs_conv RIXS_DD_gn_int.out", group='validation', error=error, ok=error <= tol)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the Polarixs readers and engines and check them against the reference loop.")
+    parser.add_argument('--size', choices=list(SIZES), default='default', help="size sweep (default: default)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per case; the fastest is kept (default: 3)")
+    parser.add_argument('--only', choices=['readers', 'engines', 'examples', 'validation'], action='append', help="run only these groups")
+    parser.add_argument('--tol', type=float, default=1e-8, help="largest relative error accepted by the validation (default: 1e-8)")
+    parser.add_argument('--json', help="write the results to this file")
+    args = parser.parse_args(argv)
+    groups = args.only or ['readers', 'engines', 'examples', 'validation']
+
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        if 'validation' in groups:
+            print("== Validation", flush=True)
+            check_engines(results, args.tol)
+            check_unpolarized(results, args.tol)
+            check_cache(results, folder)
+            check_compressed(results, folder)
+        if 'readers' in groups:
+            print("== Readers", flush=True)
+            bench_readers(results, STATES[args.size], args.repeat, folder)
+        if 'engines' in groups:
+            print("== Engines", flush=True)
+            bench_engines(results, SIZES[args.size], args.repeat)
+        if 'examples' in groups:
+            print("== Example data", flush=True)
+            bench_examples(results, args.repeat, args.tol)
+
+    failed = [entry['name'] for entry in results if entry.get('ok') is False]
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'size': args.size, 'repeat': args.repeat, 'tol': args.tol, 'numpy': np.__version__, 'results': results, 'failed': failed}, f, indent=2)
+    print(f"{len(failed)} validation failures" if failed else "All validations passed", flush=True)
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
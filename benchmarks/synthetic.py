@@ -0,0 +1,129 @@
+import numpy as np
+from Polarixs import TransitionSet
+
+###########################
+#                         #
+#  Synthetic Transitions  #
+#                         #
+###########################
+def state_energies(G, N, F, rng, edge=5900.0):
+    # ground states within 0.5 eV, final states up to 20 eV, intermediate states 40 eV wide around the edge
+    Eg = np.sort(rng.uniform(0, 0.5, G))
+    Eg[0] = 0
+    Ef = np.sort(rng.uniform(0, 20, F))
+    Ef[:min(G, F)] = Eg[:min(G, F)]
+    En = np.sort(rng.uniform(edge - 20, edge + 20, N))
+
+    return Eg, En, Ef
+
+def components(rng, rows, ncomp, soc):
+    M = rng.normal(size=(rows, ncomp))
+    if soc:
+        M = M + 1j * rng.normal(size=(rows, ncomp))
+
+    return M
+
+def transition_tables(G=2, N=40, F=30, layout='vec', soc=True, density=0.5, seed=0):
+    # (Tgn, Tnf) as Molcas_read_int ('int'), _vec ('vec') or _ten ('ten': quadrupole g->n, dipole n->f) return them,
+    # with consistent energies so that every (g,f) pair has a single DE_g,f
+    if layout not in ('int', 'vec', 'ten'):
+        raise ValueError(f"Unknown layout: {layout!r}. Use 'int', 'vec' or 'ten'.")
+
+    rng = np.random.default_rng(seed)
+    Eg, En, Ef = state_energies(G, N, F, rng)
+
+    g, n_g = np.nonzero(rng.random((G, N)) < density)
+    f, n_f = np.nonzero(rng.random((F, N)) < density)
+
+    if layout == 'int':
+        Mgn, Mnf = rng.random(len(g)), rng.random(len(f))
+    else:
+        Mgn = components(rng, len(g), 6 if layout == 'ten' else 3, soc)
+        Mnf = components(rng, len(f), 3, soc)
+
+    Tgn = TransitionSet(En[n_g] - Eg[g], Mgn, g + 1, n_g + 1)
+    Tnf = TransitionSet(En[n_f] - Ef[f], Mnf, f + 1, n_f + 1)
+
+    return Tgn, Tnf
+
+def matching_nf(Tgn, F=30, layout='vec', soc=True, density=0.5, seed=0):
+    # a synthetic n->f table for the intermediate states of a real g->n table
+    rng = np.random.default_rng(seed)
+    n_states, first = np.unique(Tgn.j, return_index=True)
+    En = Tgn.E[first] + 0.0     # the ground state of the first row of each n is taken as the zero of energy
+    Ef = np.sort(rng.uniform(0, 20, F))
+    Ef[0] = 0
+
+    f, k = np.nonzero(rng.random((F, len(n_states))) < density)
+    M = rng.random(len(f)) if layout == 'int' else components(rng, len(f), 3, soc)
+
+    return TransitionSet(En[k] - Ef[f], M, f + 1, n_states[k])
+
+#########################
+#                       #
+#  Synthetic RASSI .out #
+#                       #
+#########################
+def table_lines(header, columns, rows):
+    return ["", f"++ {header}", "   " + "-" * 40, "        for osc. strength at least   1.00000000E-08", "",
+            columns, "     " + "-" * 95] + rows + ["     " + "-" * 95]
+
+def matrix_lines(M, mltpl, comp, soc, ncol):
+    lines = ["", f"   PROPERTY: MLTPL  {mltpl}   COMPONENT:   {comp}",
+             "   ORIGIN    :  0.00000000E+00  0.00000000E+00  0.00000000E+00"]
+    nstates = len(M)
+
+    for b0 in range(0, nstates, ncol):
+        cols = range(b0, min(b0 + ncol, nstates))
+        lines.append("   STATE     :" + "".join(f"{j + 1:24d}" for j in cols))
+        for i in range(nstates):
+            if soc:
+                lines.append(f"   {i + 1:4d}   " + "".join(f"  ({M[i, j].real:10.7f},{M[i, j].imag:11.7f})" for j in cols))
+            else:
+                lines.append(f"   {i + 1:4d}   " + "".join(f"  {M[i, j]:16.8E}" for j in cols))
+
+    return lines
+
+def write_rassi_out(path, nstates=100, soc=True, density=0.3, seed=0, matrices=True, ncol=4):
+    # a RASSI-like output with the state energies, dipole and quadrupole strengths, transition vectors
+    # and (optionally) the MLTPL 1 and 2 matrices, in the layout MolcasReader parses
+    rng = np.random.default_rng(seed)
+    tag, kind = ('SO', 'SO states') if soc else ('SF', 'spin-free states')
+    E = np.sort(rng.uniform(0, 30, nstates))
+    E[0] = 0
+    E[nstates // 2:] += 5900
+
+    lines = ["  Synthetic RASSI output", "", f" {tag} State       Relative EMIN(au)   Rel lowest level(eV)    D:o, cm**(-1)", ""]
+    lines += [f"  {i + 1:4d}      {E[i] / 27.2114:16.10f}  {E[i]:18.10f}   {E[i] * 8065.54:16.4f}" for i in range(nstates)]
+    lines += ["", ""]
+
+    i, j = np.nonzero(np.triu(rng.random((nstates, nstates)) < density, 1))
+    strength = rng.uniform(1e-8, 1e-2, (2, len(i)))
+    lines += table_lines(f"Dipole transition strengths ({kind}):", "      From   To        Osc. strength",
+                         [f"     {a + 1:5d}{b + 1:5d}       {s:.8E}" for a, b, s in zip(i, j, strength[0])])
+    lines += table_lines(f"Second-order contribution to the transition strengths ({kind}):", "      From   To        Osc. strength",
+                         [f"     {a + 1:5d}{b + 1:5d}       {s:.8E}" for a, b, s in zip(i, j, strength[1])])
+
+    D = rng.normal(scale=1e-3, size=(len(i), 6 if soc else 3))
+    if soc:
+        lines += table_lines("Complex transition dipole vectors (SO states):", "      From   To       Re(Dx)       Im(Dx)       Re(Dy)       Im(Dy)       Re(Dz)       Im(Dz)",
+                             [f"     {a + 1:5d}{b + 1:5d}    " + "".join(f"  {x:11.3E}" for x in d) for a, b, d in zip(i, j, D)])
+    else:
+        lines += table_lines("Dipole transition vectors (spin-free states):", "      From   To       Dx       Dy       Dz",
+                             [f"     {a + 1:5d}{b + 1:5d}    " + "".join(f"  {x:11.3E}" for x in d) for a, b, d in zip(i, j, D)])
+
+    if matrices:
+        lines += ["", "++ Matrix elements over SO states" if soc else "++ Matrix elements", "   " + "-" * 25]
+        for mltpl, ncomp in ((1, 3), (2, 6)):
+            for comp in range(1, ncomp + 1):
+                M = rng.normal(scale=0.1, size=(nstates, nstates))
+                if soc:
+                    M = M + 1j * rng.normal(scale=0.1, size=(nstates, nstates))
+                lines += matrix_lines(M, mltpl, comp, soc, ncol)
+        lines += ["--"]
+
+    lines += ["", "++ I/O STATISTICS", ""]
+    with open(path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+    return path